@@ -1,11 +1,53 @@
 import os
+import re
 import sys
+import numpy as np
 import pandas as pd
 import pyodbc
 import glob
+import json
+import time
+import queue
+import fnmatch
+import pickle
+import atexit
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 import logging
 import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+from openpyxl import load_workbook
+
+try:
+    import python_calamine
+    CALAMINE_AVAILABLE = True
+except ImportError:
+    CALAMINE_AVAILABLE = False
+
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.parquet
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+try:
+    import xlsxwriter
+    XLSXWRITER_AVAILABLE = True
+except ImportError:
+    XLSXWRITER_AVAILABLE = False
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    WATCHDOG_AVAILABLE = False
 
 # Set up logging
 logging.basicConfig(
@@ -17,6 +59,129 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Keys of one BOM line in the demand timeline
+TIMELINE_KEYS = ['Plant', 'ps_par', 'ps_comp', 'pt_desc1', 'pt_desc2', 'ps_qty_per', 'po_vend',
+                 'pt_prod_line', 'pt_dsgn_grp', 'pt_vend', 'pt_buyer', 'pod__chr08']
+
+# BOM columns the analysis uses; batches streamed from SQL are cut down to these
+BOM_ANALYSIS_COLUMNS = TIMELINE_KEYS + ['ps_ref']
+
+# Component demand group keys and their report column names
+COMPONENT_COLUMNS = {
+    'Plant': 'Plant',
+    'ps_comp': 'Component',
+    'pt_desc1': 'Description',
+    'po_vend': 'Vendor',
+    'pt_prod_line': 'Product_Line',
+    'pt_dsgn_grp': 'Design_Group',
+    'pt_vend': 'PT_Vend',
+    'pt_buyer': 'PT_Buyer',
+    'pod__chr08': 'POD_CHR08'
+}
+
+# Parsed exports are cached next to logs/, keyed by file content
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+CACHE_VERSION = '4'
+# Cached frames are Parquet files when pyarrow is installed (categoricals stay dictionary
+# columns, and loading an entry runs no code), pickles otherwise
+CACHE_EXTENSION = '.parquet' if PYARROW_AVAILABLE else '.pkl'
+
+# Columns of the EDI export used by the analysis
+DEMAND_COLUMNS = ['Item Number', 'Date', 'Discrete Qty']
+
+# Delimited-text exports: comma-separated .csv, tab-separated .txt
+TEXT_EXPORT_SEPARATORS = {'.csv': ',', '.txt': '\t'}
+
+# Excel's "CSV UTF-8" uses the regional list separator, ; in comma-decimal locales
+TEXT_SEPARATOR_CANDIDATES = [',', ';', '\t']
+
+# Worksheet size limits of Excel, header row included
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_COLUMNS = 16384
+
+# Report columns the output can be partitioned by, and their demand cube line columns
+PARTITION_COLUMNS = {'Plant': 'Plant', 'Vendor': 'po_vend', 'Product_Line': 'pt_prod_line'}
+
+# Report writers: rows streamed with constant memory (XlsxWriter) or the openpyxl workbook
+REPORT_WRITERS = ['streaming', 'openpyxl']
+
+# Column types of the EDI export and the SQL query results. Text columns become
+# categoricals, quantities int32/float32; the demand quantity, ps_qty_per and costs
+# stay float64 because they are multiplied or summed into reported values.
+COLUMN_TYPES = {
+    'Item Number': 'category', 'Date': 'datetime', 'Discrete Qty': 'float64',
+    'Plant': 'category', 'ps_par': 'category', 'ps_comp': 'category', 'ps_ref': 'category',
+    'ps_qty_per': 'float64', 'ps_rmks': 'category',
+    'pod__chr08': 'category', 'po_vend': 'category', 'pod_nbr': 'category', 'pod_line': 'int32',
+    'pod_cum_qty[1]': 'float32', 'pod_ord_mult': 'float32', 'pod_translt_days': 'float32',
+    'pod_start_eff[1]': 'datetime', 'pod_curr_rlse_id[1]': 'category',
+    'pt_desc1': 'category', 'pt_desc2': 'category', 'pt_prod_line': 'category', 'pt_group': 'category',
+    'pt_status': 'category', 'pt_sfty_stk': 'float32', 'pt_sfty_time': 'float32', 'pt_buyer': 'category',
+    'pt_vend': 'category', 'pt__chr02': 'category', 'pt_dsgn_grp': 'category',
+    'sct_cst_tot': 'float64', 'mat_cost': 'float64', 'LBO': 'float64', 'COGS': 'float64', 'CMAT': 'float64',
+    'pt_net_wt': 'float32', 'pt_net_wt_um': 'category', 'Parent': 'category', 'Child': 'category',
+    'SFG': 'category', 'QTY_WH': 'float32', 'QTY_EXLPICK': 'float32', 'QTY_WIP': 'float32'
+}
+
+# Columns returned by each SQL query
+_PS_COLUMNS = ['Plant', 'ps_par', 'ps_comp']
+_POD_COLUMNS = ['pod__chr08', 'po_vend', 'pod_nbr', 'pod_line', 'pod_cum_qty[1]', 'pod_ord_mult',
+                'pod_translt_days', 'pod_start_eff[1]', 'pod_curr_rlse_id[1]', 'pt_desc1', 'pt_desc2',
+                'pt_prod_line', 'pt_group', 'pt_status', 'pt_sfty_stk', 'pt_sfty_time', 'pt_buyer',
+                'pt_vend', 'pt__chr02', 'pt_dsgn_grp']
+SQL_SCHEMAS = {
+    'BOMs.sql': _PS_COLUMNS + ['ps_ref', 'ps_qty_per', 'ps_rmks'],
+    'BOM_PO.sql': _PS_COLUMNS + ['ps_qty_per'] + _POD_COLUMNS,
+    'BOM_PO_Inventory_Parameters.sql': _PS_COLUMNS + ['ps_qty_per', 'ps_rmks'] + _POD_COLUMNS + [
+        'sct_cst_tot', 'mat_cost', 'LBO', 'COGS', 'CMAT', 'pt_net_wt', 'pt_net_wt_um',
+        'Parent', 'Child', 'SFG', 'QTY_WH', 'QTY_EXLPICK', 'QTY_WIP']
+}
+
+# Key columns encoded as shared categoricals, grouped by the values they have in common
+# (components are parents of their own subassemblies, vendors and buyers are compared)
+KEY_DOMAINS = [
+    ['Item Number', 'ps_par', 'ps_comp'],
+    ['Plant'],
+    ['po_vend', 'pt_vend'],
+    ['pt_buyer', 'pod__chr08'],
+    ['pt_prod_line'],
+    ['pt_dsgn_grp']
+]
+
+# Time buckets of the demand timeline
+TIME_BUCKETS = ['daily', 'weekly', 'monthly', 'custom']
+
+# BOM columns that describe the parent -> component link rather than the component
+BOM_LINK_COLUMNS = ['ps_par', 'ps_qty_per', 'ps_ref', 'ps_rmks']
+
+# Plant -> QAD database the per-plant query templates run against
+PLANT_DATABASES = {'2674': 'QADEE', '2798': 'QADEE2798'}
+
+def parse_calendar(value):
+    """
+    Parse a comma-separated list of bucket start dates (YYYY-MM-DD)
+    """
+    days = np.array([day.strip() for day in value.split(',') if day.strip()], dtype='datetime64[D]')
+    if len(days) == 0:
+        raise ValueError("calendar has no dates")
+    return np.unique(days)
+
+def parse_plant_databases(value):
+    """
+    Parse a comma-separated list of PLANT=DATABASE pairs
+    """
+    plants = {}
+    for pair in value.split(','):
+        if not pair.strip():
+            continue
+        plant, sep, database = pair.partition('=')
+        if not sep or not plant.strip() or not database.strip():
+            raise ValueError(f"expected PLANT=DATABASE, got {pair.strip()!r}")
+        plants[plant.strip()] = database.strip()
+    if not plants:
+        raise ValueError("no plants given")
+    return plants
+
 def parse_arguments():
     """
     Parse command line arguments
@@ -27,6 +192,23 @@ def parse_arguments():
                         default=r"C:\Users\ajelacn\AppData\Local\Temp\Shell",
                         help='Directory containing the exported Excel files')
     
+    parser.add_argument('--exports',
+                        default=None,
+                        help='Directory or glob of several exports to analyze together (instead of the latest file in --excel-dir)')
+    
+    parser.add_argument('--workers',
+                        type=int,
+                        default=None,
+                        help='Number of processes used to parse several exports (default: one per CPU)')
+    
+    parser.add_argument('--watch',
+                        action='store_true',
+                        help='Watch the export directory and run the analysis whenever an export is fully written')
+    
+    parser.add_argument('--watch-pattern',
+                        default='tmp*.xlsx',
+                        help='File name pattern of the exports to watch for')
+    
     parser.add_argument('--sql-file', 
                         default=r"C:\Users\ajelacn\OneDrive - Adient\Documents\Projects\QAD_automation\sql querries\BOM_PO.sql",
                         help='SQL file with BOM and PO queries')
@@ -35,6 +217,74 @@ def parse_arguments():
                         default=r"C:\Users\ajelacn\OneDrive - Adient\Documents\Projects\QAD_automation\component_demand.xlsx",
                         help='Output file for component demand report')
     
+    parser.add_argument('--cache-dir',
+                        default=CACHE_DIR,
+                        help='Directory for the cache of parsed Excel exports (SQL query results are cached in its sql subdirectory)')
+    
+    parser.add_argument('--cache-max-mb',
+                        type=float,
+                        default=500,
+                        help='Size limit of the export cache and of the query cache; least recently used entries are evicted')
+    
+    parser.add_argument('--no-cache',
+                        action='store_true',
+                        help='Always parse the Excel export and query the database, without the caches')
+    
+    parser.add_argument('--query-cache-hours',
+                        type=float,
+                        default=None,
+                        help='How long SQL query results are served from the cache in <cache-dir>/sql '
+                             '(default: 12; 0 disables it)')
+    
+    parser.add_argument('--refresh-query',
+                        action='store_true',
+                        help='Query the database even if a fresh cached result exists, and cache the new result')
+    
+    parser.add_argument('--writer',
+                        choices=REPORT_WRITERS,
+                        default='streaming' if XLSXWRITER_AVAILABLE else 'openpyxl',
+                        help='Excel writer for the report (streaming needs XlsxWriter)')
+    
+    parser.add_argument('--partition-by',
+                        choices=list(PARTITION_COLUMNS),
+                        default=None,
+                        help='Write one workbook per Plant, Vendor or Product_Line in parallel, with --output as their index')
+    
+    parser.add_argument('--parquet-dir',
+                        default=None,
+                        help='Also write every result frame as a compressed Parquet file, with a manifest, to this directory')
+    
+    parser.add_argument('--no-excel',
+                        action='store_true',
+                        help='Do not write the Excel workbook (use with --parquet-dir)')
+    
+    parser.add_argument('--history-db',
+                        default=None,
+                        help='SQLite database that each run appends its component demand, summaries and inconsistencies to')
+    
+    parser.add_argument('--sql-chunk-rows',
+                        type=int,
+                        default=None,
+                        help='Stream the SQL result in batches of this many rows, keeping only the BOM columns the analysis uses')
+    
+    parser.add_argument('--per-plant',
+                        nargs='?',
+                        type=parse_plant_databases,
+                        const=PLANT_DATABASES,
+                        default=None,
+                        metavar='PLANT=DATABASE,...',
+                        help='Run the per-plant form of the SQL query (<query>.plant.sql) once per plant, concurrently, '
+                             'and combine the results (default plants: 2674=QADEE,2798=QADEE2798)')
+    
+    parser.add_argument('--push-items',
+                        action='store_true',
+                        help='Load the demand item numbers into a temp table and fetch only their BOM rows '
+                             '(not with --explode-bom)')
+    
+    parser.add_argument('--server-aggregate',
+                        action='store_true',
+                        help='Bulk-load the demand into a temp table and sum it per BOM line on the database server')
+    
     parser.add_argument('--db-server',
                         default='a265m001',
                         help='Database server name')
@@ -43,11 +293,66 @@ def parse_arguments():
                         default='QADEE',
                         help='Database name')
     
+    parser.add_argument('--explode-bom',
+                        action='store_true',
+                        help='Explode demand through every BOM level (semi-finished goods pass demand to their components)')
+    
+    parser.add_argument('--bom-index',
+                        default=None,
+                        help='File for the persisted BOM closure index used by --explode-bom')
+    
+    parser.add_argument('--bucket',
+                        choices=TIME_BUCKETS,
+                        default='daily',
+                        help='Time bucket of the demand timeline (weeks start on Monday)')
+    
+    parser.add_argument('--calendar',
+                        type=parse_calendar,
+                        default=None,
+                        help='Comma-separated bucket start dates for --bucket custom')
+    
+    parser.add_argument('--horizon-start',
+                        type=lambda value: np.datetime64(value, 'D'),
+                        default=None,
+                        help='First demand date included in the timeline (YYYY-MM-DD)')
+    
+    parser.add_argument('--horizon-end',
+                        type=lambda value: np.datetime64(value, 'D'),
+                        default=None,
+                        help='Last demand date included in the timeline (YYYY-MM-DD)')
+    
+    parser.add_argument('--incremental-state',
+                        default=None,
+                        help='State file for incremental runs: only items whose demand changed since the previous export are re-analyzed')
+    
     parser.add_argument('--verbose', '-v',
                         action='store_true',
                         help='Enable verbose logging')
     
-    return parser.parse_args()
+    subparsers = parser.add_subparsers(dest='command')
+    where_used_parser = subparsers.add_parser('where-used',
+                                              help='List the parents that drive a component, with their demand share')
+    where_used_parser.add_argument('component',
+                                   help='Component part number (ps_comp)')
+    where_used_parser.add_argument('--plant',
+                                   default=None,
+                                   help='Restrict the lookup to one plant')
+    
+    args = parser.parse_args()
+    if args.bucket == 'custom' and args.calendar is None:
+        parser.error("--bucket custom requires --calendar")
+    if args.no_excel and not args.parquet_dir:
+        parser.error("--no-excel requires --parquet-dir")
+    if args.server_aggregate and (args.explode_bom or args.incremental_state):
+        parser.error("--server-aggregate cannot be combined with --explode-bom or --incremental-state")
+    # The server-side query joins the uploaded demand, so the BOM fetch options do not apply to it
+    if args.server_aggregate and (args.push_items or args.per_plant or args.sql_chunk_rows
+                                  or args.query_cache_hours is not None or args.refresh_query):
+        parser.error("--server-aggregate cannot be combined with --push-items, --per-plant, --sql-chunk-rows, "
+                     "--query-cache-hours or --refresh-query")
+    if args.query_cache_hours is None:
+        args.query_cache_hours = 12
+    return args
 
 def get_latest_excel_file(directory):
     """
@@ -69,90 +374,1478 @@ def get_latest_excel_file(directory):
         logger.error(f"Error finding latest Excel file: {str(e)}")
         return None
 
+def find_exports(location):
+    """
+    List the Excel and delimited-text exports in a directory or matching a glob pattern
+    """
+    if os.path.isdir(location):
+        patterns = [os.path.join(location, f"*{extension}") for extension in ['.xlsx'] + list(TEXT_EXPORT_SEPARATORS)]
+    else:
+        patterns = [location]
+    # Office lock files (~$name.xlsx) are not exports
+    exports = sorted(path for pattern in patterns for path in glob.glob(pattern)
+                     if not os.path.basename(path).startswith('~$'))
+    logger.info(f"Found {len(exports)} exports in {location}")
+    return exports
+
+def is_file_locked(file_path):
+    """
+    Check whether another process still holds the file (e.g. Excel writing the export)
+    """
+    try:
+        with open(file_path, 'r+b'):
+            return False
+    except OSError:
+        return True
+
+def wait_until_complete(file_path, interval=1.0, stable_checks=2, timeout=300):
+    """
+    Wait until the file's size and modification time stop changing and it is not locked
+    """
+    deadline = time.monotonic() + timeout
+    last_state = None
+    stable = 0
+    while time.monotonic() < deadline:
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            # Renamed or removed while being written
+            return False
+        state = (stat.st_size, stat.st_mtime)
+        stable = stable + 1 if state == last_state and stat.st_size > 0 else 0
+        last_state = state
+        if stable >= stable_checks and not is_file_locked(file_path):
+            return True
+        time.sleep(interval)
+    logger.warning(f"Timed out waiting for {file_path} to be fully written")
+    return False
+
+def watch_exports(directory, pattern, on_export, interval=1.0):
+    """
+    Watch directory for exports matching pattern and call on_export(path) once each is fully written.
+
+    Uses OS file system notifications through watchdog when it is installed,
+    otherwise polls the directory with os.scandir every interval seconds.
+    """
+    def matches(path):
+        name = os.path.basename(path)
+        # Office lock files (~$name.xlsx) are not exports
+        return fnmatch.fnmatch(name, pattern) and not name.startswith('~$')
+
+    def handle(path):
+        if wait_until_complete(path, interval):
+            logger.info(f"Export ready: {path}")
+            on_export(path)
+
+    logger.info(f"Watching {directory} for {pattern} (Ctrl+C to stop)")
+    if WATCHDOG_AVAILABLE:
+        events = queue.Queue()
+
+        class ExportHandler(FileSystemEventHandler):
+            def on_created(self, event):
+                if not event.is_directory and matches(event.src_path):
+                    events.put(event.src_path)
+
+            def on_moved(self, event):
+                if not event.is_directory and matches(event.dest_path):
+                    events.put(event.dest_path)
+
+            def on_modified(self, event):
+                # An export rewritten in place (e.g. EDI_Demand.xlsx) is a new export too
+                if not event.is_directory and matches(event.src_path):
+                    events.put(event.src_path)
+
+        observer = Observer()
+        observer.schedule(ExportHandler(), directory, recursive=False)
+        observer.start()
+        handled = {}
+        try:
+            while True:
+                path = events.get()
+                # Further events for the same file are covered by waiting for it to be complete
+                pending = {path}
+                while not events.empty():
+                    pending.add(events.get())
+                for path in sorted(pending):
+                    # Modified events left over from a write that was already analyzed
+                    if os.path.exists(path) and handled.get(path) == os.stat(path).st_mtime:
+                        continue
+                    handle(path)
+                    if os.path.exists(path):
+                        handled[path] = os.stat(path).st_mtime
+        except KeyboardInterrupt:
+            logger.info("Watch stopped")
+        finally:
+            observer.stop()
+            observer.join()
+    else:
+        seen = {entry.path: entry.stat().st_mtime for entry in os.scandir(directory) if matches(entry.path)}
+        try:
+            while True:
+                time.sleep(interval)
+                for entry in os.scandir(directory):
+                    if not matches(entry.path):
+                        continue
+                    mtime = entry.stat().st_mtime
+                    if seen.get(entry.path) != mtime:
+                        handle(entry.path)
+                        seen[entry.path] = os.stat(entry.path).st_mtime if os.path.exists(entry.path) else mtime
+        except KeyboardInterrupt:
+            logger.info("Watch stopped")
+
+def apply_schema(df, columns, source):
+    """
+    Convert the frame's columns to their COLUMN_TYPES in one vectorized pass per column.
+
+    Values that cannot be converted become missing; they are reported once per
+    source with a count per column and a sample of row numbers, not row by row.
+    """
+    missing_columns = [col for col in columns if col not in df.columns]
+    if missing_columns:
+        logger.warning(f"{source}: expected columns missing: {', '.join(missing_columns)}")
+
+    df = df.copy()
+    bad_rows = pd.Series(False, index=df.index)
+    bad_counts = {}
+    for col in df.columns:
+        kind = COLUMN_TYPES.get(col)
+        values = df[col]
+        present = values.notna()
+        if kind == 'category':
+            # Part numbers read as numbers from Excel must match the text from SQL; a column
+            # with blanks is read as float, so 12345.0 is written back as 12345
+            if pd.api.types.is_float_dtype(values):
+                whole = present & (values % 1 == 0)
+                text = values.astype(str).mask(whole, values[whole].astype('Int64').astype(str))
+            elif values.dtype == object:
+                text = values.map(lambda value: str(int(value)) if isinstance(value, float) and value.is_integer() else str(value))
+            else:
+                text = values.astype(str)
+            text = text.str.strip()
+            df[col] = text.where(present).astype('category')
+            continue
+        if kind == 'datetime':
+            converted = pd.to_datetime(values, errors='coerce')
+            bad = present & converted.isna()
+        elif kind in ('int32', 'float32', 'float64'):
+            converted = pd.to_numeric(values, errors='coerce')
+            bad = present & converted.isna()
+            if kind == 'int32':
+                fractional = converted.notna() & (converted % 1 != 0)
+                converted = converted.mask(fractional)
+                bad |= fractional
+                converted = converted.astype('Int32' if converted.isna().any() else 'int32')
+            else:
+                converted = converted.astype(kind)
+        else:
+            continue
+        df[col] = converted
+        if bad.any():
+            bad_counts[col] = int(bad.sum())
+            bad_rows |= bad
+
+    if bad_counts:
+        details = ', '.join(f"{col} ({count})" for col, count in bad_counts.items())
+        sample = df.index[bad_rows.to_numpy()][:10].tolist()
+        logger.warning(f"{source}: {int(bad_rows.sum())} rows with invalid values set to missing: {details}. "
+                       f"First rows: {sample}")
+    return df
+
+def read_excel_columns(file_path, columns=DEMAND_COLUMNS):
+    """
+    Stream only the given columns of the first sheet, row by row.
+
+    Uses calamine when python-calamine is installed, otherwise openpyxl in
+    read-only mode. Date cells already come back as datetimes from either
+    engine, so the Date column is typed while the rows are collected.
+    """
+    if CALAMINE_AVAILABLE:
+        df = pd.read_excel(file_path, engine='calamine',
+                           usecols=lambda col: str(col).strip() in columns)
+        df.columns = [str(col).strip() for col in df.columns]
+        return df
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(col).strip() if col is not None else '' for col in next(rows, ())]
+        positions = [(col, header.index(col)) for col in columns if col in header]
+        values = {col: [] for col, _ in positions}
+        for row in rows:
+            selected = [row[position] if position < len(row) else None for _, position in positions]
+            # Trailing formatted-but-empty rows carry no data
+            if all(value is None for value in selected):
+                continue
+            for (col, _), value in zip(positions, selected):
+                values[col].append(value)
+    finally:
+        workbook.close()
+
+    df = pd.DataFrame(values)
+    if 'Date' in df.columns:
+        df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+    return df
+
+def parse_text_dates(values, separator, source):
+    """
+    Parse the date text of a delimited-text export with one day/month order for
+    the whole column: a first field above 12 means day first, a second field
+    above 12 month first; otherwise a ; separated (comma-decimal locale) export
+    is read day first, with a warning as the order is only guessed. ISO dates
+    (year first) are not affected.
+    """
+    fields = values.dropna().astype(str).str.strip().str.extract(r'^(\d{1,2})[./-](\d{1,2})[./-]\d{2,4}')
+    first = pd.to_numeric(fields[0], errors='coerce')
+    second = pd.to_numeric(fields[1], errors='coerce')
+    if (first > 12).any():
+        dayfirst = True
+    elif (second > 12).any():
+        dayfirst = False
+    elif first.notna().any():
+        dayfirst = separator == ';'
+        logger.warning(f"{source}: date order is ambiguous (no day above 12), reading dates as "
+                       f"{'day/month' if dayfirst else 'month/day'} as the '{separator}' separator suggests; "
+                       f"check them if the export comes from a {'month' if dayfirst else 'day'}-first locale")
+    else:
+        dayfirst = False
+    return pd.to_datetime(values, dayfirst=dayfirst, errors='coerce')
+
+def read_text_columns(file_path, columns=DEMAND_COLUMNS):
+    """
+    Read only the given columns of a delimited-text export.
+
+    Uses pyarrow's multithreaded CSV reader when pyarrow is installed,
+    otherwise pandas' C parser. Excel's "CSV UTF-8" byte order mark is skipped,
+    the separator is detected from the header line, and Item Number is read
+    as text so that leading zeros of part numbers are kept.
+    """
+    default_separator = TEXT_EXPORT_SEPARATORS[os.path.splitext(file_path)[1].lower()]
+    with open(file_path, 'r', encoding='utf-8-sig', newline='') as file:
+        header_line = file.readline().rstrip('\r\n')
+    separator = max(TEXT_SEPARATOR_CANDIDATES, key=lambda candidate: (header_line.count(candidate),
+                                                                       candidate == default_separator))
+    header = header_line.split(separator)
+    names = {col.strip().strip('"'): col.strip('"') for col in header}
+    usecols = [names[col] for col in columns if col in names]
+    # Part numbers and regional dates are parsed here, not guessed by the reader
+    text_columns = [names[col] for col in ['Item Number', 'Date'] if col in names]
+    decimal = ',' if separator == ';' else '.'
+
+    if PYARROW_AVAILABLE:
+        table = pyarrow.csv.read_csv(
+            file_path,
+            parse_options=pyarrow.csv.ParseOptions(delimiter=separator),
+            convert_options=pyarrow.csv.ConvertOptions(
+                include_columns=usecols,
+                column_types={col: pyarrow.string() for col in text_columns},
+                decimal_point=decimal
+            )
+        )
+        df = table.to_pandas()
+    else:
+        df = pd.read_csv(file_path, sep=separator, usecols=usecols, encoding='utf-8-sig', engine='c',
+                         dtype={col: str for col in text_columns}, decimal=decimal)
+    df.columns = [str(col).strip() for col in df.columns]
+    if 'Date' in df.columns:
+        df['Date'] = parse_text_dates(df['Date'], separator, os.path.basename(file_path))
+    return df
+
 def read_excel_data(file_path):
     """
-    Read customer demand data from Excel file
+    Read customer demand data from an Excel file or a delimited-text export
     """
     try:
-        logger.info(f"Reading Excel file: {file_path}")
-        df = pd.read_excel(file_path)
+        logger.info(f"Reading export: {file_path}")
+        if os.path.splitext(file_path)[1].lower() in TEXT_EXPORT_SEPARATORS:
+            df = read_text_columns(file_path)
+        else:
+            df = read_excel_columns(file_path)
         
-        # Clean up column names (remove whitespace)
-        df.columns = [col.strip() for col in df.columns]
+        # Type the columns; calamine leaves text dates as they are
+        df = apply_schema(df, DEMAND_COLUMNS, os.path.basename(file_path))
+        
+        logger.info(f"Export data loaded successfully. {len(df)} rows found.")
+        return df
+    except Exception as e:
+        logger.error(f"Error reading export: {str(e)}")
+        return None
+
+def file_content_hash(file_path):
+    """
+    SHA-256 of the file content
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def evict_cache(cache_dir, max_bytes):
+    """
+    Remove the least recently used cache entries until the cache fits in max_bytes
+    """
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith(('.parquet', '.pkl'))]
+    entries.sort(key=os.path.getmtime)
+    total = sum(os.path.getsize(entry) for entry in entries)
+    for entry in entries:
+        if total <= max_bytes:
+            break
+        total -= os.path.getsize(entry)
+        os.remove(entry)
+        logger.info(f"Evicted cache entry: {entry}")
+
+def write_cached_frame(df, cache_path):
+    """
+    Write a frame to a cache file in the format of its extension
+    """
+    if cache_path.endswith('.parquet'):
+        df.to_parquet(cache_path)
+    else:
+        df.to_pickle(cache_path)
+
+def read_cached_frame(cache_path):
+    """
+    Read a frame written by write_cached_frame
+    """
+    if cache_path.endswith('.parquet'):
+        return pd.read_parquet(cache_path)
+    return pd.read_pickle(cache_path)
+
+def read_excel_data_cached(file_path, cache_dir=CACHE_DIR, max_bytes=500 * 1024 * 1024):
+    """
+    Read customer demand data through the on-disk cache of parsed exports.
+
+    Entries are keyed by the content hash of the file, so a re-exported
+    file with identical content is a hit too. Hits are touched so eviction
+    removes the least recently used entries first.
+    """
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        cache_path = os.path.join(cache_dir, f"{file_content_hash(file_path)}-{CACHE_VERSION}{CACHE_EXTENSION}")
         
-        # Convert date columns to datetime if needed
-        if 'Date' in df.columns:
-            df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+        if os.path.exists(cache_path):
+            try:
+                df = read_cached_frame(cache_path)
+                os.utime(cache_path)
+                logger.info(f"Loaded cached export for {file_path}. {len(df)} rows found.")
+                return df
+            except Exception as e:
+                logger.warning(f"Could not load cached export, parsing the file: {str(e)}")
         
-        logger.info(f"Excel data loaded successfully. {len(df)} rows found.")
+        df = read_excel_data(file_path)
+        if df is not None:
+            write_cached_frame(df, cache_path)
+            evict_cache(cache_dir, max_bytes)
         return df
     except Exception as e:
-        logger.error(f"Error reading Excel file: {str(e)}")
+        logger.warning(f"Export cache unavailable: {str(e)}")
+        return read_excel_data(file_path)
+
+class ConnectionPool:
+    """
+    Pool of open database connections with health checks and statement reuse.
+
+    connect is a zero-argument factory returning a DB-API connection
+    (pyodbc for SQL Server; sqlite3 works as a local stand-in). Idle
+    connections are checked with health_check_sql before they are handed out
+    and replaced if they fail. Each connection keeps one cursor per SQL text,
+    so a repeated statement runs on the cursor that already prepared it.
+    """
+
+    def __init__(self, connect, max_size=4, health_check_sql='SELECT 1', max_statements=16):
+        self.connect = connect
+        self.max_size = max_size
+        self.health_check_sql = health_check_sql
+        self.max_statements = max_statements
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._size = 0
+
+    def _open(self):
+        return [self.connect(), OrderedDict()]
+
+    def _discard(self, entry):
+        with self._lock:
+            self._size -= 1
+        try:
+            entry[0].close()
+        except Exception:
+            pass
+
+    def _healthy(self, entry):
+        try:
+            cursor = entry[0].cursor()
+            cursor.execute(self.health_check_sql)
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception as e:
+            logger.warning(f"Pooled connection failed its health check, reconnecting: {str(e)}")
+            return False
+
+    def _acquire(self):
+        while True:
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_open = self._size < self.max_size
+                    if can_open:
+                        self._size += 1
+                if can_open:
+                    try:
+                        return self._open()
+                    except Exception:
+                        with self._lock:
+                            self._size -= 1
+                        raise
+                entry = self._idle.get()
+            if self._healthy(entry):
+                return entry
+            self._discard(entry)
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection entry [connection, cursors]; it is returned to the pool
+        afterwards, or closed if the work on it failed
+        """
+        entry = self._acquire()
+        completed = False
+        try:
+            yield entry
+            completed = True
+        finally:
+            # Also covers a batch reader that was abandoned half way
+            if completed:
+                self._idle.put(entry)
+            else:
+                self._discard(entry)
+
+    def execute(self, sql, params=None, prepare=None):
+        """
+        Run a statement and return its rows and column names. prepare, if given,
+        is called with the connection first (e.g. to load a temp table).
+        """
+        with self.connection() as (connection, cursors):
+            if prepare is not None:
+                prepare(connection)
+            cursor = cursors.pop(sql, None) or connection.cursor()
+            if params is None:
+                cursor.execute(sql)
+            else:
+                cursor.execute(sql, params)
+            columns = [column[0] for column in cursor.description] if cursor.description else []
+            rows = cursor.fetchall() if cursor.description else []
+            # Keep the cursor for this SQL text, dropping the least recently used one
+            cursors[sql] = cursor
+            while len(cursors) > self.max_statements:
+                cursors.popitem(last=False)[1].close()
+            return rows, columns
+
+    def iter_batches(self, sql, chunk_rows, params=None, prepare=None):
+        """
+        Run a query and yield its result as DataFrames of at most chunk_rows rows
+        """
+        with self.connection() as (connection, cursors):
+            if prepare is not None:
+                prepare(connection)
+            cursor = connection.cursor()
+            if params is None:
+                cursor.execute(sql)
+            else:
+                cursor.execute(sql, params)
+            columns = [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                yield pd.DataFrame.from_records([tuple(row) for row in rows], columns=columns)
+            cursor.close()
+
+    def read_sql(self, sql, params=None, prepare=None):
+        """
+        Run a query and return its result as a DataFrame
+        """
+        rows, columns = self.execute(sql, params, prepare)
+        return pd.DataFrame.from_records([tuple(row) for row in rows], columns=columns)
+
+    def close(self):
+        """
+        Close every idle connection
+        """
+        while True:
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(entry)
+
+# One pool per database server and name, shared by every query in the process
+_CONNECTION_POOLS = {}
+_CONNECTION_POOLS_LOCK = threading.Lock()
+
+def get_connection_pool(db_server, db_name):
+    """
+    Shared pool of trusted connections to one SQL Server database
+    """
+    with _CONNECTION_POOLS_LOCK:
+        pool = _CONNECTION_POOLS.get((db_server, db_name))
+        if pool is None:
+            conn_str = (
+                f"DRIVER={{SQL Server}};"
+                f"SERVER={db_server};"
+                f"DATABASE={db_name};"
+                f"Trusted_Connection=yes;"
+            )
+            pool = ConnectionPool(lambda: pyodbc.connect(conn_str))
+            _CONNECTION_POOLS[(db_server, db_name)] = pool
+        return pool
+
+@atexit.register
+def close_connection_pools():
+    """
+    Close the pooled connections when the process exits
+    """
+    for pool in _CONNECTION_POOLS.values():
+        pool.close()
+
+def sql_schema(sql_file_path):
+    """
+    Expected result columns of a SQL query file (none are checked for unknown queries)
+    """
+    return SQL_SCHEMAS.get(os.path.basename(sql_file_path), [])
+
+# Commented-out filter lines the demand item push-down switches on
+DEMAND_ITEMS_MARKER = re.compile(r'^(\s*)-- @demand_items: ?', re.MULTILINE)
+
+def restrict_to_demand_items(sql_query):
+    """
+    Enable the query's "-- @demand_items:" lines, which restrict its BOM reads
+    to the parents in the [#demand_items] temp table; None if it has none
+    """
+    restricted, count = DEMAND_ITEMS_MARKER.subn(r'\1', sql_query)
+    return restricted if count else None
+
+def load_demand_items(connection, items):
+    """
+    Create the [#demand_items] temp table on the connection and bulk-load the item numbers
+    """
+    cursor = connection.cursor()
+    # SQLite (the local stand-in) needs TEMP; a # name is already temporary on SQL Server
+    temporary = 'TEMP ' if isinstance(connection, sqlite3.Connection) else ''
+    # tempdb may have another collation than the ERP database (error 468 on the comparison)
+    collate = '' if isinstance(connection, sqlite3.Connection) else ' COLLATE DATABASE_DEFAULT'
+    cursor.execute("DROP TABLE IF EXISTS [#demand_items]")
+    # No unique key: items differing only in case are one value under a case-insensitive collation
+    cursor.execute(f"CREATE {temporary}TABLE [#demand_items] ([item] NVARCHAR(450){collate} NOT NULL)")
+    if hasattr(cursor, 'fast_executemany'):
+        cursor.fast_executemany = True
+    cursor.executemany("INSERT INTO [#demand_items] ([item]) VALUES (?)", [(item,) for item in items])
+    cursor.execute("CREATE INDEX [ix_demand_items] ON [#demand_items] ([item])")
+    cursor.close()
+
+def split_final_select(sql_query):
+    """
+    Split a query into the body of its WITH clause (None without one) and its
+    final statement, so that it can be reused as a CTE of a larger query.
+    Comments, strings, [identifiers] and parentheses are skipped while looking
+    for the top-level keywords; a trailing ; ends the statement.
+    """
+    depth = 0
+    i = 0
+    words = []
+    closes = []
+    end = len(sql_query)
+    while i < len(sql_query):
+        char = sql_query[i]
+        if sql_query.startswith('--', i):
+            newline = sql_query.find('\n', i)
+            i = len(sql_query) if newline < 0 else newline
+            continue
+        if sql_query.startswith('/*', i):
+            close = sql_query.find('*/', i + 2)
+            i = len(sql_query) if close < 0 else close + 2
+            continue
+        if char in "'[":
+            closer = "'" if char == "'" else ']'
+            i += 1
+            while i < len(sql_query):
+                if sql_query[i] == closer:
+                    # A doubled closer is an escaped one
+                    if sql_query.startswith(closer * 2, i):
+                        i += 2
+                        continue
+                    break
+                i += 1
+            i += 1
+            continue
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                closes.append(i)
+        elif char == ';' and depth == 0:
+            end = i
+            break
+        elif (char.isalpha() or char == '_') and depth == 0:
+            start = i
+            while i < len(sql_query) and (sql_query[i].isalnum() or sql_query[i] == '_'):
+                i += 1
+            words.append((sql_query[start:i].upper(), start, i))
+            continue
+        i += 1
+    
+    if not words:
+        raise ValueError("SQL query has no statement")
+    if words[0][0] != 'WITH':
+        return None, sql_query[:end].strip()
+    final = next((start for word, start, _ in words[1:] if word == 'SELECT'), None)
+    if final is None:
+        raise ValueError("SQL query has a WITH clause but no final SELECT")
+    # The last CTE ends at its closing parenthesis, before any comment on the final SELECT
+    last_close = max(close for close in closes if close < final)
+    return sql_query[words[0][2]:last_close + 1].strip(), sql_query[final:end].strip()
+
+def load_demand_buckets(connection, demand_buckets):
+    """
+    Create the [#demand] temp table on the connection and bulk-load (item, bucket, qty) rows
+    """
+    cursor = connection.cursor()
+    temporary = 'TEMP ' if isinstance(connection, sqlite3.Connection) else ''
+    collate = '' if isinstance(connection, sqlite3.Connection) else ' COLLATE DATABASE_DEFAULT'
+    cursor.execute("DROP TABLE IF EXISTS [#demand]")
+    # As for [#demand_items]: database collation for the join, and no key that case variants would break
+    cursor.execute(f"CREATE {temporary}TABLE [#demand] ([item] NVARCHAR(450){collate} NOT NULL, "
+                   f"[bucket] DATE NOT NULL, [qty] FLOAT NOT NULL)")
+    if hasattr(cursor, 'fast_executemany'):
+        cursor.fast_executemany = True
+    cursor.executemany("INSERT INTO [#demand] ([item], [bucket], [qty]) VALUES (?, ?, ?)",
+                       list(demand_buckets.itertuples(index=False, name=None)))
+    cursor.execute("CREATE INDEX [ix_demand] ON [#demand] ([item], [bucket])")
+    cursor.close()
+
+def reduce_bom_rows(bom_df, columns):
+    """
+    Collapse BOM rows that are identical on columns into one row, counting
+    them in BOM_Rows (e.g. the PO lines the BOM_PO join repeats a link for)
+    """
+    bom_df = bom_df[columns + (['BOM_Rows'] if 'BOM_Rows' in bom_df.columns else [])]
+    if 'BOM_Rows' not in bom_df.columns:
+        bom_df = bom_df.assign(BOM_Rows=1)
+    return bom_df.groupby(columns, dropna=False, observed=True, sort=False)['BOM_Rows'].sum().reset_index()
+
+def read_sql_batches(pool, sql_query, chunk_rows, schema, source, prepare=None):
+    """
+    Fetch a query in batches of chunk_rows rows. Each batch is typed, cut down to
+    the columns the analysis uses and collapsed with reduce_bom_rows as it
+    arrives, so memory follows the distinct BOM lines, not the joined rows.
+    """
+    reduced = []
+    reduced_rows = 0
+    fetched = 0
+    for batch in pool.iter_batches(sql_query, chunk_rows, prepare=prepare):
+        fetched += len(batch)
+        batch = apply_schema(batch, [], source)
+        columns = [col for col in BOM_ANALYSIS_COLUMNS if col in batch.columns]
+        reduced.append(reduce_bom_rows(batch, columns))
+        reduced_rows += len(reduced[-1])
+        # Re-collapse once the collected batches outgrow a few chunks
+        if reduced_rows > 4 * chunk_rows:
+            reduced = [reduce_bom_rows(pd.concat(reduced, ignore_index=True), columns)]
+            reduced_rows = len(reduced[0])
+    
+    if not reduced:
+        return apply_schema(pd.DataFrame(columns=schema), schema, source)
+    bom_df = reduce_bom_rows(pd.concat(reduced, ignore_index=True), columns)
+    logger.info(f"SQL query streamed in batches: {fetched} rows fetched, {len(bom_df)} distinct BOM lines kept")
+    return apply_schema(bom_df, [col for col in schema if col in BOM_ANALYSIS_COLUMNS], source)
+
+def plant_query_path(sql_file_path):
+    """
+    Per-plant template of a SQL query file (BOMs.sql -> BOMs.plant.sql)
+    """
+    root, ext = os.path.splitext(sql_file_path)
+    return f"{root}.plant{ext}"
+
+def read_sql_per_plant(pool, template, plants, chunk_rows, schema, source, prepare=None):
+    """
+    Run a per-plant query template once per plant, each on its own pooled
+    connection in a thread, and combine the results. The fetch takes as long
+    as the slowest plant rather than the sum of all plants.
+    """
+    # One connection per plant so no plant waits for another
+    pool.max_size = max(pool.max_size, len(plants))
+    
+    def fetch(plant, database):
+        start = time.time()
+        sql = template.format(plant=plant, database=database)
+        if chunk_rows:
+            plant_df = read_sql_batches(pool, sql, chunk_rows, schema, f"{source} ({plant})", prepare)
+        else:
+            plant_df = pool.read_sql(sql, prepare=prepare)
+        logger.info(f"Plant {plant} ({database}): {len(plant_df)} rows in {time.time() - start:.1f}s")
+        return plant_df
+    
+    with ThreadPoolExecutor(max_workers=len(plants)) as executor:
+        futures = [executor.submit(fetch, plant, database) for plant, database in plants.items()]
+        plant_frames = [future.result() for future in futures]
+    
+    # Re-typing the combined frame unifies the plants' categories
+    bom_df = pd.concat(plant_frames, ignore_index=True)
+    logger.info(f"Per-plant SQL queries combined: {len(bom_df)} rows from {len(plants)} plants")
+    return apply_schema(bom_df, [] if chunk_rows else schema, source)
+
+class QueryCache:
+    """
+    On-disk cache of SQL query results with a time to live.
+
+    Entries are keyed by a hash of the SQL text, server and database (plus the
+    fetch options that shape the result) and hold the typed frame with its
+    fetch time, as Parquet with the time in the file metadata when pyarrow is
+    installed and pickled otherwise (see CACHE_EXTENSION). Entries older than ttl_seconds are fetched again, refresh
+    skips every lookup, and hits are touched so evict_cache removes the least
+    recently used entries first.
+    """
+
+    def __init__(self, cache_dir, ttl_seconds, max_bytes, refresh=False):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.refresh = refresh
+
+    def key(self, *parts):
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(repr(part).encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}-{CACHE_VERSION}{CACHE_EXTENSION}")
+
+    def get(self, key):
+        """
+        Cached result for key, or None if there is none, it expired or a refresh was asked for
+        """
+        if self.refresh:
+            return None
+        cache_path = self._path(key)
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            if cache_path.endswith('.parquet'):
+                table = pyarrow.parquet.read_table(cache_path)
+                fetched_at = float(table.schema.metadata[b'fetched_at'])
+                df = table.to_pandas()
+            else:
+                fetched_at, df = pd.read_pickle(cache_path)
+        except Exception as e:
+            logger.warning(f"Could not load cached query result, querying the database: {str(e)}")
+            return None
+        age = time.time() - fetched_at
+        if age > self.ttl_seconds:
+            logger.info(f"Cached query result expired ({age / 3600:.1f} h old), querying the database")
+            return None
+        os.utime(cache_path)
+        logger.info(f"Loaded cached query result ({age / 60:.0f} min old). {len(df)} rows found.")
+        return df
+
+    def put(self, key, df):
+        """
+        Store a freshly fetched result and evict the least recently used entries
+        """
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            cache_path = self._path(key)
+            if cache_path.endswith('.parquet'):
+                table = pyarrow.Table.from_pandas(df)
+                metadata = {**(table.schema.metadata or {}), b'fetched_at': repr(time.time()).encode('ascii')}
+                pyarrow.parquet.write_table(table.replace_schema_metadata(metadata), cache_path)
+            else:
+                pd.to_pickle((time.time(), df), cache_path)
+            evict_cache(self.cache_dir, self.max_bytes)
+        except Exception as e:
+            logger.warning(f"Could not cache query result: {str(e)}")
+
+def execute_sql_query(sql_file_path, db_server, db_name, chunk_rows=None, plants=None, cache=None, items=None):
+    """
+    Execute SQL query from file and return results as DataFrame.
+    With chunk_rows the result is streamed in batches (see read_sql_batches);
+    with plants (plant -> database) the per-plant form of the query is run
+    concurrently for each plant (see read_sql_per_plant). Results from the
+    database are served from cache (a QueryCache) while they are fresh.
+    With items the query only returns BOM rows of those parents.
+    """
+    try:
+        # Read SQL query from file
+        logger.info(f"Reading SQL query from: {sql_file_path}")
+        with open(sql_file_path, 'r') as file:
+            sql_query = file.read()
+        
+        logger.info("SQL query loaded successfully")
+        
+        # Per-plant form of the query, if asked for and available
+        template = None
+        if plants:
+            template_path = plant_query_path(sql_file_path)
+            if os.path.exists(template_path):
+                with open(template_path, 'r') as file:
+                    template = file.read()
+            else:
+                logger.warning(f"No per-plant query {template_path}, running the combined query")
+        
+        # Push the demand items down into the query as a temp table
+        prepare = None
+        if items is not None:
+            restricted = restrict_to_demand_items(sql_query if template is None else template)
+            if restricted is None:
+                logger.warning("The SQL query has no -- @demand_items: filter, fetching the BOM of every parent")
+                items = None
+            else:
+                if template is None:
+                    sql_query = restricted
+                else:
+                    template = restricted
+                items = sorted(set(items))
+                prepare = lambda connection: load_demand_items(connection, items)
+                logger.info(f"Restricting the BOM query to {len(items)} demand items")
+        
+        # Look up the result of the same SQL on the same database
+        cache_key = None
+        if cache is not None:
+            if template is None:
+                cache_key = cache.key(sql_query, db_server, db_name, chunk_rows, items)
+            else:
+                cache_key = cache.key(template, sorted(plants.items()), db_server, db_name, chunk_rows, items)
+            bom_df = cache.get(cache_key)
+            if bom_df is not None:
+                return bom_df
+        
+        try:
+            # Try to connect to the database and execute the query
+            logger.info(f"Attempting to connect to database server: {db_server}, database: {db_name}")
+            
+            # Run the query on a pooled connection
+            try:
+                pool = get_connection_pool(db_server, db_name)
+                schema = sql_schema(sql_file_path)
+                source = os.path.basename(sql_file_path)
+                if template is not None:
+                    bom_df = read_sql_per_plant(pool, template, plants, chunk_rows, schema, source, prepare)
+                elif chunk_rows:
+                    bom_df = read_sql_batches(pool, sql_query, chunk_rows, schema, source, prepare)
+                else:
+                    bom_df = pool.read_sql(sql_query, prepare=prepare)
+                    logger.info(f"SQL query executed successfully. {len(bom_df)} rows returned.")
+                    bom_df = apply_schema(bom_df, schema, source)
+                
+                if cache_key is not None:
+                    cache.put(cache_key, bom_df)
+                return bom_df
+            except Exception as db_error:
+                logger.warning(f"Database connection failed: {str(db_error)}")
+                logger.warning("Using mock BOM data instead")
+                
+                # If database connection fails, use mock data
+                bom_data = {
+                    'Plant': ['2674', '2674', '2798', '2798'],
+                    'ps_par': ['PART1', 'PART2', 'PART3', 'PART4'],
+                    'ps_comp': ['COMP1', 'COMP2', 'COMP3', 'COMP4'],
+                    'pt_desc1': ['Description 1', 'Description 2', 'Description 3', 'Description 4'],
+                    'pt_desc2': ['Detail 1', 'Detail 2', 'Detail 3', 'Detail 4'],
+                    'ps_qty_per': [2, 3, 1, 4],
+                    'po_vend': ['VEND1', 'VEND2', 'VEND3', 'VEND4'],
+                    'pt_prod_line': ['LINE1', 'LINE2', 'LINE1', 'LINE2'],
+                    'pt_dsgn_grp': ['GROUP1', 'GROUP2', 'GROUP1', 'GROUP2']
+                }
+                bom_df = pd.DataFrame(bom_data)
+                logger.info(f"Mock BOM data created. {len(bom_df)} rows.")
+                return apply_schema(bom_df, [], 'mock BOM data')
+                
+        except Exception as e:
+            logger.error(f"Error in database operations: {str(e)}")
+            return None
+            
+    except Exception as e:
+        logger.error(f"Error executing SQL query: {str(e)}")
         return None
 
-def execute_sql_query(sql_file_path, db_server, db_name):
+def encode_keys(demand_df, bom_df):
+    """
+    Encode the key columns of the demand and BOM frames as categoricals.
+
+    Columns of one KEY_DOMAINS group share a single categorical dtype, so merges,
+    groupbys and comparisons between them run on the integer codes. The text is
+    only restored by decode_keys when the results are written.
+    """
+    frames = [demand_df.copy(), bom_df.copy()]
+    for domain in KEY_DOMAINS:
+        columns = [(frame, col) for frame in frames for col in domain if col in frame.columns]
+        if not columns:
+            continue
+        values = pd.concat([frame[col] for frame, col in columns], ignore_index=True)
+        categories = pd.Index(values.dropna().unique())
+        try:
+            categories = categories.sort_values()
+        except TypeError:
+            # Mixed text and numbers cannot be ordered; keep first-seen order
+            pass
+        dtype = pd.CategoricalDtype(categories)
+        for frame, col in columns:
+            frame[col] = frame[col].astype(dtype)
+
+    logger.info("Key columns encoded as categoricals")
+    return frames[0], frames[1]
+
+def decode_keys(df):
+    """
+    Restore categorical columns to their plain values for output
+    """
+    df = df.copy()
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(object)
+    return df
+
+def build_bom_children(bom_df):
+    """
+    Build the direct-children adjacency of the BOM, per plant:
+    {plant: {parent: {component: qty_per}}}
+    """
+    # The PO join repeats each ps_mstr row once per PO line, so keep one row per BOM link
+    link_columns = [col for col in ['Plant', 'ps_par', 'ps_comp', 'ps_ref', 'ps_qty_per'] if col in bom_df.columns]
+    links = bom_df[link_columns].dropna(subset=['Plant', 'ps_par', 'ps_comp']).drop_duplicates()
+
+    children = {}
+    for plant, parent, component, qty_per in zip(links['Plant'], links['ps_par'],
+                                                 links['ps_comp'], links['ps_qty_per'].fillna(0)):
+        parent_children = children.setdefault(plant, {}).setdefault(parent, {})
+        parent_children[component] = parent_children.get(component, 0) + qty_per
+    return children
+
+def explode_bom(children, plant, items, memo=None):
+    """
+    Explode items over every BOM level of one plant.
+
+    Returns {item: {component: extended qty}} where every component below the
+    item (subassemblies and their parts) carries the product of ps_qty_per down
+    its path. Each subassembly is exploded once and reused wherever it is used;
+    a memo of already exploded parts can be passed in and is filled in place.
+    Cyclic links are reported and skipped. Which link closes a cycle depends on
+    where the walk entered it, so parts that reach a cycle are exploded again
+    for every item and never memoized.
+    """
+    plant_children = children.get(plant, {})
+    memo = {} if memo is None else memo
+    visiting = set()
+    reported = set()
+
+    def explode(part):
+        """
+        Returns (vector, cyclic); a cyclic vector skipped a link and is only valid on this path
+        """
+        if part in memo:
+            return memo[part], False
+        visiting.add(part)
+        vector = {}
+        cyclic = False
+        for component, qty_per in plant_children.get(part, {}).items():
+            if component in visiting:
+                if (part, component) not in reported:
+                    reported.add((part, component))
+                    logger.warning(f"BOM cycle detected in plant {plant}: {part} -> {component}. Link skipped.")
+                cyclic = True
+                continue
+            vector[component] = vector.get(component, 0) + qty_per
+            sub_vector, sub_cyclic = explode(component)
+            cyclic = cyclic or sub_cyclic
+            for sub_component, sub_qty in sub_vector.items():
+                vector[sub_component] = vector.get(sub_component, 0) + qty_per * sub_qty
+        visiting.discard(part)
+        if not cyclic:
+            memo[part] = vector
+        return vector, cyclic
+
+    return {item: explode(item)[0] for item in items if item in plant_children}
+
+def build_where_used(bom_df):
+    """
+    Build the reverse BOM adjacency, per plant:
+    {plant: {component: {parent: qty_per}}}
+    """
+    parents = {}
+    for plant, plant_children in build_bom_children(bom_df).items():
+        plant_parents = parents.setdefault(plant, {})
+        for parent, links in plant_children.items():
+            for component, qty_per in links.items():
+                plant_parents.setdefault(component, {})[parent] = qty_per
+    return parents
+
+def where_used(parents, component, plant=None, demand_df=None):
+    """
+    List every parent above a component, directly or through subassemblies,
+    with the extended quantity of the component per parent.
+
+    With demand_df, each parent's demand and its share of the component
+    demand (parent demand x extended quantity) are added.
+    """
+    rows = []
+    for plant_code in ([plant] if plant else parents):
+        direct = parents.get(plant_code, {}).get(component, {})
+        # Exploding the reversed BOM walks up from the component to every ancestor
+        ancestors = explode_bom(parents, plant_code, [component]).get(component, {})
+        rows.extend((plant_code, parent, qty, parent in direct) for parent, qty in ancestors.items())
+    result = pd.DataFrame(rows, columns=['Plant', 'Parent', 'Qty_Per', 'Direct'])
+
+    if demand_df is not None:
+        parent_demand = demand_df.groupby(demand_df['Item Number'].astype(object))['Discrete Qty'].sum()
+        result['Parent_Demand'] = result['Parent'].map(parent_demand).fillna(0)
+        result['Component_Demand'] = result['Parent_Demand'] * result['Qty_Per']
+        total = result['Component_Demand'].sum()
+        result['Demand_Share'] = result['Component_Demand'] / total if total else 0.0
+        result = result.sort_values('Component_Demand', ascending=False)
+
+    return result.reset_index(drop=True)
+
+def bom_fingerprint(links):
+    """
+    Fingerprint of one parent's direct BOM links ({component: qty_per})
+    """
+    return hashlib.sha1(repr(sorted(links.items())).encode('utf-8')).hexdigest()
+
+def build_bom_closure(bom_df, index_path=None):
+    """
+    Transitive BOM closure per plant: {plant: {parent: {component: extended qty}}}.
+
+    When index_path is given the closure is persisted there together with a
+    fingerprint of every parent's direct links. On the next run only parents
+    whose links changed, and every parent above them, are exploded again; the
+    rest of the closure is reused from disk.
+    """
+    children = build_bom_children(bom_df)
+    fingerprints = {plant: {parent: bom_fingerprint(links) for parent, links in plant_children.items()}
+                    for plant, plant_children in children.items()}
+
+    index = None
+    if index_path and os.path.exists(index_path):
+        try:
+            with open(index_path, 'rb') as file:
+                index = pickle.load(file)
+            logger.info(f"Loaded BOM closure index: {index_path}")
+        except Exception as e:
+            logger.warning(f"Could not load BOM closure index, rebuilding: {str(e)}")
+            index = None
+
+    if index is not None and index['fingerprints'] == fingerprints:
+        logger.info("BOM unchanged since the index was built, using it as is")
+        return index['closure']
+
+    closure = {}
+    acyclic = {}
+    for plant, plant_children in children.items():
+        old_fingerprints = index['fingerprints'].get(plant, {}) if index else {}
+        old_closure = index['closure'].get(plant, {}) if index else {}
+        changed = {parent for parent in set(plant_children) | set(old_fingerprints)
+                   if fingerprints[plant].get(parent) != old_fingerprints.get(parent)}
+
+        # A changed subassembly invalidates every parent that uses it, directly or not
+        parents_of = {}
+        for parent, links in plant_children.items():
+            for component in links:
+                parents_of.setdefault(component, set()).add(parent)
+        stale = set()
+        pending = list(changed)
+        while pending:
+            part = pending.pop()
+            if part in stale:
+                continue
+            stale.add(part)
+            pending.extend(parents_of.get(part, ()))
+
+        # Only vectors without a skipped cycle link hold for every path and can seed the memo
+        old_acyclic = index.get('acyclic', {}).get(plant, set()) if index else set()
+        memo = {part: vector for part, vector in old_closure.items() if part not in stale and part in old_acyclic}
+        closure[plant] = explode_bom(children, plant, plant_children, memo)
+        acyclic[plant] = set(memo)
+        logger.info(f"BOM closure for plant {plant}: {len(plant_children)} parents, "
+                    f"{len(stale & set(plant_children))} re-exploded")
+
+    if index_path:
+        try:
+            with open(index_path, 'wb') as file:
+                pickle.dump({'fingerprints': fingerprints, 'closure': closure, 'acyclic': acyclic}, file,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            logger.info(f"BOM closure index saved: {index_path}")
+        except Exception as e:
+            logger.warning(f"Could not save BOM closure index: {str(e)}")
+
+    return closure
+
+def explode_bom_frame(bom_df, items, closure=None):
+    """
+    Multi-level replacement for bom_df: one row per (Plant, top-level item, component)
+    with the extended ps_qty_per, joined to the component's own BOM/PO attributes.
+    A precomputed closure (see build_bom_closure) is looked up instead of exploding.
+    """
+    items = pd.Series(items).dropna().unique()
+    if closure is None:
+        children = build_bom_children(bom_df)
+        closure = {plant: explode_bom(children, plant, items) for plant in children}
+
+    rows = []
+    for plant, plant_closure in closure.items():
+        for item in items:
+            vector = plant_closure.get(item)
+            if vector:
+                rows.extend((plant, item, component, qty) for component, qty in vector.items())
+    exploded = pd.DataFrame(rows, columns=['Plant', 'ps_par', 'ps_comp', 'ps_qty_per'])
+    for col in ['Plant', 'ps_par', 'ps_comp']:
+        exploded[col] = exploded[col].astype(bom_df[col].dtype)
+
+    # Component attributes (descriptions, vendors, PO lines) do not depend on the parent
+    attribute_columns = [col for col in bom_df.columns if col not in BOM_LINK_COLUMNS]
+    attributes = bom_df[attribute_columns]
+    if 'BOM_Rows' in attributes.columns:
+        # Every parent link of a component is joined to the same PO lines
+        keys = [col for col in attribute_columns if col != 'BOM_Rows']
+        attributes = attributes.groupby(keys, dropna=False, observed=True, sort=False)['BOM_Rows'].max().reset_index()
+    else:
+        attributes = attributes.drop_duplicates()
+    exploded = exploded.merge(attributes, on=['Plant', 'ps_comp'], how='left')
+
+    logger.info(f"BOM exploded over all levels: {len(exploded)} rows for {len(items)} items")
+    return exploded
+
+def bucket_days(days, bucket='daily', calendar=None):
+    """
+    Map day ordinals (datetime64[D]) to the first day of their time bucket.
+
+    Buckets are computed on the integer ordinals: weeks start on Monday,
+    months on the 1st, and a custom calendar is a sorted array of bucket
+    start days. Days before the first calendar day map to NaT.
+    """
+    if bucket == 'daily':
+        return days
+    if bucket == 'weekly':
+        # Day 0 (1970-01-01) is a Thursday, so Monday is 3 days earlier
+        ordinals = days.astype('int64')
+        return (ordinals - (ordinals + 3) % 7).astype('datetime64[D]')
+    if bucket == 'monthly':
+        return days.astype('datetime64[M]').astype('datetime64[D]')
+    if bucket == 'custom':
+        positions = np.searchsorted(calendar, days, side='right') - 1
+        buckets = calendar[np.maximum(positions, 0)]
+        buckets[positions < 0] = np.datetime64('NaT')
+        return buckets
+    raise ValueError(f"Unknown time bucket: {bucket}")
+
+class DemandCube:
+    """
+    Compact demand cube: BOM lines x dates over one contiguous quantity array.
+
+    Each line is one (item, component) BOM row with its attributes; item and
+    component are integer-coded, and `quantities[line, date]` holds the summed
+    parent demand. The wide "Demand Timeline" and "Component Demand" frames are
+    derived from the cube only when they are needed.
+    """
+
+    def __init__(self, lines, dates, quantities):
+        self.lines = lines.reset_index(drop=True)
+        self.dates = dates
+        self.quantities = quantities
+        self.item_codes, self.items = pd.factorize(self.lines['ps_par'], sort=True)
+        self.component_codes, self.components = pd.factorize(self.lines['ps_comp'], sort=True)
+
+    @classmethod
+    def from_merged(cls, merged_data, value_column='Discrete Qty', bucket='daily', calendar=None,
+                    start=None, end=None):
+        """
+        Build the cube from demand rows merged with BOM rows, with one date
+        column per time bucket between start and end (see bucket_days)
+        """
+        # Rows without a date or with incomplete BOM keys never reach the timeline
+        valid = merged_data[TIMELINE_KEYS + ['Date']].notna().all(axis=1).to_numpy(copy=True)
+        days = merged_data['Date'].to_numpy().astype('datetime64[D]')
+        if start is not None:
+            valid &= days >= start
+        if end is not None:
+            valid &= days <= end
+        buckets = bucket_days(days[valid], bucket, calendar)
+        in_calendar = ~np.isnat(buckets)
+        valid[valid] = in_calendar
+        buckets = buckets[in_calendar]
+        data = merged_data.loc[valid]
+
+        grouped = data.groupby(TIMELINE_KEYS, sort=True, observed=True)
+        line_codes = grouped.ngroup().to_numpy()
+        lines = grouped.size().index.to_frame(index=False)
+
+        # Dates are coded on bucket start ordinals, so all timestamps of one bucket share a column
+        date_codes, dates = pd.factorize(buckets, sort=True)
+
+        values = data[value_column]
+        weights = values.fillna(0).to_numpy(dtype='float64')
+        # BOM rows collapsed by reduce_bom_rows count as often as they were fetched
+        if 'BOM_Rows' in data.columns:
+            weights = weights * data['BOM_Rows'].to_numpy(dtype='float64')
+        n_lines, n_dates = len(lines), len(dates)
+        quantities = np.bincount(
+            line_codes * n_dates + date_codes,
+            weights=weights,
+            minlength=n_lines * n_dates
+        ).reshape(n_lines, n_dates)
+        if pd.api.types.is_integer_dtype(values.dtype):
+            quantities = quantities.astype('int64')
+
+        return cls(lines, pd.DatetimeIndex(dates), quantities)
+
+    @classmethod
+    def from_line_buckets(cls, line_buckets, value_column='Quantity'):
+        """
+        Build the cube from (BOM line keys, bucket, quantity) rows, as summed
+        on the database server by component_demand_sql
+        """
+        grouped = line_buckets.groupby(TIMELINE_KEYS, sort=True, observed=True)
+        line_codes = grouped.ngroup().to_numpy()
+        lines = grouped.size().index.to_frame(index=False)
+        days = pd.to_datetime(line_buckets['bucket']).to_numpy().astype('datetime64[D]')
+        date_codes, dates = pd.factorize(days, sort=True)
+
+        values = line_buckets[value_column]
+        dtype = 'int64' if pd.api.types.is_integer_dtype(values.dtype) else 'float64'
+        quantities = np.zeros((len(lines), len(dates)), dtype=dtype)
+        np.add.at(quantities, (line_codes, date_codes), values.to_numpy(dtype=dtype))
+        return cls(lines, pd.DatetimeIndex(dates), quantities)
+
+    def subset(self, mask):
+        """
+        Cube with only the lines selected by a boolean mask
+        """
+        return DemandCube(self.lines.loc[mask], self.dates, self.quantities[mask])
+
+    def without_items(self, items):
+        """
+        Cube without the lines of the given parent items
+        """
+        return self.subset(~self.lines['ps_par'].isin(items).to_numpy())
+
+    @classmethod
+    def concat(cls, cubes):
+        """
+        Stack cubes with disjoint lines over the union of their dates, in sorted line order
+        """
+        dates = cubes[0].dates
+        for cube in cubes[1:]:
+            dates = dates.union(cube.dates)
+
+        dtype = np.result_type(*[cube.quantities.dtype for cube in cubes])
+        blocks = []
+        for cube in cubes:
+            block = np.zeros((cube.n_lines, len(dates)), dtype=dtype)
+            block[:, dates.get_indexer(cube.dates)] = cube.quantities
+            blocks.append(block)
+
+        lines = pd.concat([cube.lines for cube in cubes], ignore_index=True)
+        order = lines.sort_values(TIMELINE_KEYS, kind='stable').index.to_numpy()
+        return cls(lines.loc[order], dates, np.concatenate(blocks)[order])
+
+    @property
+    def n_lines(self):
+        return len(self.lines)
+
+    @property
+    def n_dates(self):
+        return len(self.dates)
+
+    @property
+    def date_labels(self):
+        return list(self.dates.strftime('%Y-%m-%d'))
+
+    def demand_matrix(self):
+        """
+        Component demand per line and date (parent quantity x ps_qty_per)
+        """
+        qty_per = self.lines['ps_qty_per'].to_numpy()
+        return self.quantities * qty_per[:, None]
+
+    def timeline_frame(self, start=0, stop=None):
+        """
+        Materialize the wide "Demand Timeline" view: raw quantities and Demand_<date> columns,
+        for lines start..stop
+        """
+        labels = self.date_labels
+        lines = self.lines.iloc[start:stop].reset_index(drop=True)
+        quantities = self.quantities[start:stop]
+        qty_per = lines['ps_qty_per'].to_numpy()
+        quantity_frame = pd.DataFrame(quantities, columns=labels)
+        demand = pd.DataFrame(quantities * qty_per[:, None], columns=[f'Demand_{label}' for label in labels])
+        return pd.concat([lines, quantity_frame, demand], axis=1)
+
+    def timeline_long_frame(self, start=0, stop=None):
+        """
+        Materialize the long "Demand Timeline" view for lines start..stop: one row per line
+        and date with a non-zero quantity
+        """
+        quantities = self.quantities[start:stop]
+        line_idx, date_idx = np.nonzero(quantities)
+        lines = self.lines.iloc[start:stop].iloc[line_idx].reset_index(drop=True)
+        lines['Date'] = self.dates[date_idx]
+        lines['Quantity'] = quantities[line_idx, date_idx]
+        lines['Demand'] = lines['Quantity'] * lines['ps_qty_per']
+        return lines
+
+    def timeline_sheets(self, max_rows=EXCEL_MAX_ROWS, max_columns=EXCEL_MAX_COLUMNS, chunk_lines=10000):
+        """
+        Lay the timeline out within Excel's sheet limits.
+
+        The wide layout is used while its columns fit in max_columns, the long
+        layout otherwise. Lines are split over as many sheets as needed to
+        stay within max_rows. Returns [(sheet name, chunks)], where chunks
+        lazily yields frames of at most chunk_lines lines.
+        """
+        wide = len(self.lines.columns) + 2 * self.n_dates <= max_columns
+        frame = self.timeline_frame if wide else self.timeline_long_frame
+        rows_per_line = np.ones(self.n_lines, dtype='int64') if wide else np.count_nonzero(self.quantities, axis=1)
+        logger.info(f"Demand Timeline layout: {'wide' if wide else 'long'}")
+
+        return sheet_chunks('Demand Timeline', frame, rows_per_line, max_rows, chunk_lines)
+
+    def component_frame(self):
+        """
+        Materialize the "Component Demand" view: demand summed per component and plant
+        """
+        labels = self.date_labels
+        grouped = self.lines.groupby(list(COMPONENT_COLUMNS), sort=True, observed=True)
+        group_codes = grouped.ngroup().to_numpy()
+
+        sums = pd.DataFrame(self.demand_matrix(), columns=labels).groupby(group_codes).sum()
+        component_demand = grouped.size().index.to_frame(index=False)
+        component_demand.columns = list(COMPONENT_COLUMNS.values())
+        component_demand = pd.concat([component_demand, sums.reset_index(drop=True)], axis=1)
+
+        # Total accumulated date by date, in timeline order
+        if labels:
+            component_demand['Total_Demand'] = np.add.accumulate(sums.to_numpy(), axis=1)[:, -1]
+        else:
+            component_demand['Total_Demand'] = 0
+        return component_demand
+
+def build_demand_cube(demand_df, bom_df, verbose=False, explode=False, bom_closure=None,
+                      bucket='daily', calendar=None, start=None, end=None):
+    """
+    Merge demand rows with BOM rows and build the demand cube
+    """
+    # Merge BOM data with demand data
+    logger.info("\nMerging BOM data with demand data...")
+
+    # Create a copy of the demand dataframe to avoid modifying the original
+    demand_copy = demand_df.copy()
+
+    # Replace the single-level BOM with the multi-level explosion if requested
+    if explode:
+        logger.info("Exploding BOM over all levels...")
+        bom_df = explode_bom_frame(bom_df, demand_copy['Item Number'], bom_closure)
+
+    # Merge on Item Number (from demand) and ps_par (from BOM)
+    merged_data = pd.merge(
+        demand_copy,
+        bom_df,
+        left_on='Item Number',
+        right_on='ps_par',
+        how='left'
+    )
+
+    # Check for parts without BOM data
+    missing_bom = merged_data[merged_data['ps_par'].isna()]
+    if not missing_bom.empty:
+        missing_count = len(missing_bom['Item Number'].unique())
+        logger.warning(f"\n{missing_count} parts don't have BOM data")
+        if verbose:
+            missing_parts = missing_bom['Item Number'].unique()
+            logger.warning(missing_parts[:10].tolist())
+            if len(missing_parts) > 10:
+                logger.warning(f"... and {len(missing_parts) - 10} more")
+
+    # Build the demand cube (BOM lines x dates) instead of a wide pivot
+    logger.info(f"\nBuilding demand cube with {bucket} buckets as axis...")
+    demand_cube = DemandCube.from_merged(merged_data, bucket=bucket, calendar=calendar,
+                                         start=start, end=end)
+    logger.info(f"Demand cube: {demand_cube.n_lines} BOM lines x {demand_cube.n_dates} dates")
+    
+    return demand_cube
+
+def summarize_demand_cube(demand_cube):
     """
-    Execute SQL query from file and return results as DataFrame
+    Derive component demand, inconsistency report and summary dashboards from the demand cube
     """
-    try:
-        # Read SQL query from file
-        logger.info(f"Reading SQL query from: {sql_file_path}")
-        with open(sql_file_path, 'r') as file:
-            sql_query = file.read()
-        
-        logger.info("SQL query loaded successfully")
-        
-        try:
-            # Try to connect to the database and execute the query
-            logger.info(f"Attempting to connect to database server: {db_server}, database: {db_name}")
-            conn_str = (
-                f"DRIVER={{SQL Server}};"
-                f"SERVER={db_server};"
-                f"DATABASE={db_name};"
-                f"Trusted_Connection=yes;"
-            )
-            
-            # Try to connect to the database
-            try:
-                conn = pyodbc.connect(conn_str)
-                logger.info("Connected to database successfully")
-                
-                # Execute the query
-                bom_df = pd.read_sql(sql_query, conn)
-                logger.info(f"SQL query executed successfully. {len(bom_df)} rows returned.")
-                
-                return bom_df
-            except Exception as db_error:
-                logger.warning(f"Database connection failed: {str(db_error)}")
-                logger.warning("Using mock BOM data instead")
-                
-                # If database connection fails, use mock data
-                bom_data = {
-                    'Plant': ['2674', '2674', '2798', '2798'],
-                    'ps_par': ['PART1', 'PART2', 'PART3', 'PART4'],
-                    'ps_comp': ['COMP1', 'COMP2', 'COMP3', 'COMP4'],
-                    'pt_desc1': ['Description 1', 'Description 2', 'Description 3', 'Description 4'],
-                    'pt_desc2': ['Detail 1', 'Detail 2', 'Detail 3', 'Detail 4'],
-                    'ps_qty_per': [2, 3, 1, 4],
-                    'po_vend': ['VEND1', 'VEND2', 'VEND3', 'VEND4'],
-                    'pt_prod_line': ['LINE1', 'LINE2', 'LINE1', 'LINE2'],
-                    'pt_dsgn_grp': ['GROUP1', 'GROUP2', 'GROUP1', 'GROUP2']
-                }
-                bom_df = pd.DataFrame(bom_data)
-                logger.info(f"Mock BOM data created. {len(bom_df)} rows.")
-                return bom_df
-                
-        except Exception as e:
-            logger.error(f"Error in database operations: {str(e)}")
-            return None
-            
-    except Exception as e:
-        logger.error(f"Error executing SQL query: {str(e)}")
-        return None
+    # Calculate component demand for each date
+    logger.info("\nCalculating component demand for each date...")
+    return {'demand_cube': demand_cube, **summarize_component_demand(demand_cube.component_frame())}
+
+def summarize_component_demand(component_demand):
+    """
+    Derive the inconsistency report and summary dashboards from the component demand
+    """
+    # Sort by total demand (descending)
+    component_demand = component_demand.sort_values('Total_Demand', ascending=False)
+
+    # Create inconsistency report
+    logger.info("\nCreating inconsistency report...")
+
+    # Filter rows where pt_vend <> po_vend or pt_buyer <> pod__chr08
+    inconsistent_data = component_demand[
+        (component_demand['PT_Vend'] != component_demand['Vendor']) | 
+        (component_demand['PT_Buyer'] != component_demand['POD_CHR08'])
+    ].copy()
+
+    # Add inconsistency flags for clarity
+    inconsistent_data['Vendor_Mismatch'] = inconsistent_data['PT_Vend'] != inconsistent_data['Vendor']
+    inconsistent_data['Buyer_Mismatch'] = inconsistent_data['PT_Buyer'] != inconsistent_data['POD_CHR08']
+
+    # Sort by component
+    inconsistent_data = inconsistent_data.sort_values(['Component', 'Plant'])
+
+    # Create summary dashboards
+    logger.info("\nCreating summary dashboards...")
+
+    # Summary by Vendor
+    vendor_summary = component_demand.groupby('Vendor', observed=True)['Total_Demand'].sum().reset_index()
+    vendor_summary = vendor_summary.sort_values('Total_Demand', ascending=False)
+
+    # Summary by Product Line
+    product_line_summary = component_demand.groupby('Product_Line', observed=True)['Total_Demand'].sum().reset_index()
+    product_line_summary = product_line_summary.sort_values('Total_Demand', ascending=False)
+
+    # Summary by Design Group
+    design_group_summary = component_demand.groupby('Design_Group', observed=True)['Total_Demand'].sum().reset_index()
+    design_group_summary = design_group_summary.sort_values('Total_Demand', ascending=False)
+
+    # Combined summary (Vendor + Product Line)
+    combined_summary = component_demand.groupby(['Vendor', 'Product_Line'], observed=True)['Total_Demand'].sum().reset_index()
+    combined_summary = combined_summary.sort_values('Total_Demand', ascending=False)
 
-def analyze_demand_with_bom(demand_df, bom_df, verbose=False):
+    logger.info("\nComponent demand calculation completed")
+
+    # Return all the dataframes for reporting
+    return {
+        'component_demand': component_demand,
+        'vendor_summary': vendor_summary,
+        'product_line_summary': product_line_summary,
+        'design_group_summary': design_group_summary,
+        'combined_summary': combined_summary,
+        'inconsistent_data': inconsistent_data
+    }
+
+def analyze_demand_with_bom(demand_df, bom_df, verbose=False, explode=False, bom_closure=None,
+                            bucket='daily', calendar=None, start=None, end=None):
     """
-    Analyze customer demand data with BOM data to calculate component demand
+    Analyze customer demand data with BOM data to calculate component demand.
+    With explode=True demand is carried through every BOM level, so
+    semi-finished goods pass their demand on to their own components;
+    bom_closure is a precomputed closure from build_bom_closure.
+    The timeline is bucketed and limited to start..end (see DemandCube.from_merged).
     """
     try:
         logger.info("Analyzing demand data with BOM data...")
@@ -180,178 +1873,376 @@ def analyze_demand_with_bom(demand_df, bom_df, verbose=False):
         # Extract part numbers from demand data
         # Assuming 'Item Number' column contains the part numbers
         if 'Item Number' in demand_df.columns:
-            # Merge BOM data with demand data
-            logger.info("\nMerging BOM data with demand data...")
-            
-            # Create a copy of the demand dataframe to avoid modifying the original
-            demand_copy = demand_df.copy()
-            
-            # Merge on Item Number (from demand) and ps_par (from BOM)
-            merged_data = pd.merge(
-                demand_copy,
-                bom_df,
-                left_on='Item Number',
-                right_on='ps_par',
-                how='left'
-            )
-            
-            # Check for parts without BOM data
-            missing_bom = merged_data[merged_data['ps_par'].isna()]
-            if not missing_bom.empty:
-                missing_count = len(missing_bom['Item Number'].unique())
-                logger.warning(f"\n{missing_count} parts don't have BOM data")
-                if verbose:
-                    missing_parts = missing_bom['Item Number'].unique()
-                    logger.warning(missing_parts[:10].tolist())
-                    if len(missing_parts) > 10:
-                        logger.warning(f"... and {len(missing_parts) - 10} more")
-            
-            # Create pivot table with dates as columns
-            logger.info("\nCreating pivot table with dates as columns...")
-            
-            # Format the date column to be used as pivot columns
-            merged_data['Date_Formatted'] = merged_data['Date'].dt.strftime('%Y-%m-%d')
-            
-            # Create a pivot table for the timeline of demand
-            pivot_df = pd.pivot_table(
-                merged_data,
-                values='Discrete Qty',
-                index=['Plant', 'ps_par', 'ps_comp', 'pt_desc1', 'pt_desc2', 'ps_qty_per', 'po_vend', 'pt_prod_line', 'pt_dsgn_grp', 'pt_vend', 'pt_buyer', 'pod__chr08'],
-                columns='Date_Formatted',
-                aggfunc='sum',
-                fill_value=0
-            )
-            
-            # Reset index to convert back to a regular DataFrame
-            pivot_df = pivot_df.reset_index()
-            
-            # Calculate component demand for each date
-            logger.info("\nCalculating component demand for each date...")
-            
-            # Get the date columns
-            date_columns = [col for col in pivot_df.columns if col not in 
-                           ['Plant', 'ps_par', 'ps_comp', 'pt_desc1', 'pt_desc2', 'ps_qty_per', 'po_vend', 'pt_prod_line', 'pt_dsgn_grp', 'pt_vend', 'pt_buyer', 'pod__chr08']]
-            
-            # Calculate component demand by multiplying quantity by ps_qty_per
-            for date_col in date_columns:
-                pivot_df[f'Demand_{date_col}'] = pivot_df[date_col] * pivot_df['ps_qty_per']
-            
-            # Create a summary dataframe for component demand by date
-            component_demand = pd.DataFrame()
-            
-            # Group by component and plant
-            grouped = pivot_df.groupby(['Plant', 'ps_comp', 'pt_desc1', 'po_vend', 'pt_prod_line', 'pt_dsgn_grp', 'pt_vend', 'pt_buyer', 'pod__chr08'])
-            
-            # Create summary rows for each component
-            component_rows = []
-            
-            for (plant, component, desc, vendor, prod_line, design_group, pt_vend, pt_buyer, pod_chr08), group in grouped:
-                row = {
-                    'Plant': plant,
-                    'Component': component,
-                    'Description': desc,
-                    'Vendor': vendor,
-                    'Product_Line': prod_line,
-                    'Design_Group': design_group,
-                    'PT_Vend': pt_vend,
-                    'PT_Buyer': pt_buyer,
-                    'POD_CHR08': pod_chr08
-                }
-                
-                # Add demand for each date
-                for date_col in date_columns:
-                    demand_col = f'Demand_{date_col}'
-                    row[date_col] = group[demand_col].sum()
-                
-                # Add total demand
-                row['Total_Demand'] = sum(row[date_col] for date_col in date_columns)
-                
-                component_rows.append(row)
-            
-            # Create component demand dataframe
-            component_demand = pd.DataFrame(component_rows)
-            
-            # Sort by total demand (descending)
-            component_demand = component_demand.sort_values('Total_Demand', ascending=False)
-            
-            # Create inconsistency report
-            logger.info("\nCreating inconsistency report...")
-            
-            # Filter rows where pt_vend <> po_vend or pt_buyer <> pod__chr08
-            inconsistent_data = component_demand[
-                (component_demand['PT_Vend'] != component_demand['Vendor']) | 
-                (component_demand['PT_Buyer'] != component_demand['POD_CHR08'])
-            ].copy()
-            
-            # Add inconsistency flags for clarity
-            inconsistent_data['Vendor_Mismatch'] = inconsistent_data['PT_Vend'] != inconsistent_data['Vendor']
-            inconsistent_data['Buyer_Mismatch'] = inconsistent_data['PT_Buyer'] != inconsistent_data['POD_CHR08']
-            
-            # Sort by component
-            inconsistent_data = inconsistent_data.sort_values(['Component', 'Plant'])
-            
-            # Create summary dashboards
-            logger.info("\nCreating summary dashboards...")
-            
-            # Summary by Vendor
-            vendor_summary = component_demand.groupby('Vendor')['Total_Demand'].sum().reset_index()
-            vendor_summary = vendor_summary.sort_values('Total_Demand', ascending=False)
-            
-            # Summary by Product Line
-            product_line_summary = component_demand.groupby('Product_Line')['Total_Demand'].sum().reset_index()
-            product_line_summary = product_line_summary.sort_values('Total_Demand', ascending=False)
+            demand_cube = build_demand_cube(demand_df, bom_df, verbose, explode, bom_closure,
+                                            bucket, calendar, start, end)
+            return summarize_demand_cube(demand_cube)
+        else:
+            logger.error("Column 'Item Number' not found in demand data")
+            return None
             
-            # Summary by Design Group
-            design_group_summary = component_demand.groupby('Design_Group')['Total_Demand'].sum().reset_index()
-            design_group_summary = design_group_summary.sort_values('Total_Demand', ascending=False)
+    except Exception as e:
+        logger.error(f"Error analyzing demand with BOM: {str(e)}")
+        logger.error(f"Stack trace:", exc_info=True)
+        return None
+
+def demand_snapshot(demand_df, value_column='Discrete Qty'):
+    """
+    Demand quantity per (Item Number, day) with plain item values, for comparing exports
+    """
+    snapshot = pd.DataFrame({
+        'Item Number': demand_df['Item Number'].astype(object),
+        'Date': pd.to_datetime(demand_df['Date']).dt.normalize(),
+        'Qty': demand_df[value_column].fillna(0)
+    })
+    return snapshot.groupby(['Item Number', 'Date'])['Qty'].sum()
+
+def analyze_demand_incremental(demand_df, bom_df, state_path, verbose=False, explode=False, bom_closure=None,
+                               bucket='daily', calendar=None, start=None, end=None):
+    """
+    Incremental variant of analyze_demand_with_bom.
+
+    The demand snapshot and demand cube of the previous run are kept in
+    state_path. When the BOM and timeline options are unchanged, only items
+    whose quantity changed on some date, or that gained or lost a date, are
+    merged and exploded again; their cube lines replace the old ones and the
+    reports are derived from the patched cube. Date buckets left without any
+    demand row are dropped, as a full build would not have them.
+    Otherwise the full analysis runs and the state is written for next time.
+    """
+    try:
+        if 'Item Number' not in demand_df.columns:
+            logger.error("Column 'Item Number' not found in demand data")
+            return None
+        
+        snapshot = demand_snapshot(demand_df)
+        signature = {
+            'bom': hashlib.sha1(pd.util.hash_pandas_object(bom_df, index=False).to_numpy().tobytes()).hexdigest(),
+            'explode': explode,
+            'bucket': bucket,
+            'calendar': None if calendar is None else [str(day) for day in calendar],
+            'start': None if start is None else str(start),
+            'end': None if end is None else str(end)
+        }
+        
+        state = None
+        if os.path.exists(state_path):
+            try:
+                with open(state_path, 'rb') as file:
+                    state = pickle.load(file)
+            except Exception as e:
+                logger.warning(f"Could not load incremental state: {str(e)}")
+        
+        if state is not None and state['signature'] == signature:
+            # Items with any (Item Number, Date) quantity that differs from the previous export, or
+            # with a date only one of the exports has (a missing key is NaN, which differs from any qty)
+            both = pd.concat([state['snapshot'], snapshot], axis=1, keys=['old', 'new'])
+            changed = both.index[both['old'] != both['new']].get_level_values('Item Number').unique()
+            logger.info(f"Incremental run: {len(changed)} of {snapshot.index.get_level_values(0).nunique()} "
+                        f"items changed since the previous export")
             
-            # Combined summary (Vendor + Product Line)
-            combined_summary = component_demand.groupby(['Vendor', 'Product_Line'])['Total_Demand'].sum().reset_index()
-            combined_summary = combined_summary.sort_values('Total_Demand', ascending=False)
+            # Re-code the stored lines with this run's categories (same BOM, so no value is lost)
+            old_cube = state['demand_cube']
+            lines = old_cube.lines.copy()
+            for col in TIMELINE_KEYS:
+                if isinstance(bom_df[col].dtype, pd.CategoricalDtype):
+                    lines[col] = lines[col].astype(object).astype(bom_df[col].dtype)
+            demand_cube = DemandCube(lines, old_cube.dates, old_cube.quantities).without_items(list(changed))
             
-            logger.info("\nComponent demand calculation completed")
+            changed_demand = demand_df[demand_df['Item Number'].isin(list(changed))]
+            if not changed_demand.empty:
+                changed_cube = build_demand_cube(changed_demand, bom_df, verbose, explode, bom_closure,
+                                                 bucket, calendar, start, end)
+                demand_cube = DemandCube.concat([demand_cube, changed_cube])
             
-            # Return all the dataframes for reporting
-            return {
-                'pivot_table': pivot_df,
-                'component_demand': component_demand,
-                'vendor_summary': vendor_summary,
-                'product_line_summary': product_line_summary,
-                'design_group_summary': design_group_summary,
-                'combined_summary': combined_summary,
-                'inconsistent_data': inconsistent_data
-            }
+            # Keep the date buckets a full build has: those of the demand rows of items with cube lines
+            with_lines = demand_df[demand_df['Item Number'].isin(demand_cube.lines['ps_par'].unique())]
+            expected = pd.to_datetime(demand_buckets(with_lines, bucket, calendar, start, end)['bucket'])
+            used = demand_cube.dates.isin(expected)
+            demand_cube = DemandCube(demand_cube.lines, demand_cube.dates[used], demand_cube.quantities[:, used])
         else:
+            logger.info("No matching incremental state, running the full analysis")
+            demand_cube = build_demand_cube(demand_df, bom_df, verbose, explode, bom_closure,
+                                            bucket, calendar, start, end)
+        
+        try:
+            with open(state_path, 'wb') as file:
+                pickle.dump({'signature': signature, 'snapshot': snapshot, 'demand_cube': demand_cube}, file,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            logger.info(f"Incremental state saved: {state_path}")
+        except Exception as e:
+            logger.warning(f"Could not save incremental state: {str(e)}")
+        
+        return summarize_demand_cube(demand_cube)
+    
+    except Exception as e:
+        logger.error(f"Error in incremental analysis: {str(e)}")
+        logger.error(f"Stack trace:", exc_info=True)
+        return None
+
+def demand_buckets(demand_df, bucket='daily', calendar=None, start=None, end=None):
+    """
+    Demand quantity per (item, time bucket start) as plain (item, 'YYYY-MM-DD', qty) rows,
+    with the same date filters as DemandCube.from_merged
+    """
+    valid = (demand_df['Item Number'].notna() & demand_df['Date'].notna()).to_numpy(copy=True)
+    days = demand_df['Date'].to_numpy().astype('datetime64[D]')
+    if start is not None:
+        valid &= days >= start
+    if end is not None:
+        valid &= days <= end
+    buckets = bucket_days(days[valid], bucket, calendar)
+    in_calendar = ~np.isnat(buckets)
+    valid[valid] = in_calendar
+    
+    rows = pd.DataFrame({
+        'item': demand_df['Item Number'].loc[valid].astype(str).to_numpy(),
+        'bucket': np.datetime_as_string(buckets[in_calendar], unit='D'),
+        'qty': demand_df['Discrete Qty'].loc[valid].fillna(0).to_numpy(dtype='float64')
+    })
+    return rows.groupby(['item', 'bucket'], sort=False)['qty'].sum().reset_index()
+
+def component_demand_sql(sql_query):
+    """
+    Wrap the BOM query into one aggregation over the [#demand] temp table: parent
+    quantities are summed per BOM line and bucket, as in DemandCube.from_merged.
+    Whole demand quantities add up exactly in any order; ps_qty_per is applied
+    on the client by DemandCube.component_frame, so both analyses add the
+    fractional products in the same order.
+    """
+    ctes, final = split_final_select(sql_query)
+    line_keys = ', '.join(f'b.[{col}]' for col in TIMELINE_KEYS)
+    complete = ' AND '.join(f'b.[{col}] IS NOT NULL' for col in TIMELINE_KEYS)
+    # Prefixed so that the wrapper cannot clash with a table or CTE of the query
+    return (
+        f"WITH {ctes + ',' if ctes else ''}\n"
+        f"[analyze_demand_bom] AS (\n{final}\n)\n"
+        f"SELECT {line_keys}, d.[bucket], SUM(d.[qty]) AS [Quantity]\n"
+        f"FROM [analyze_demand_bom] b JOIN [#demand] d ON d.[item] = b.[ps_par]\n"
+        f"WHERE {complete}\n"
+        f"GROUP BY {line_keys}, d.[bucket]"
+    )
+
+def analyze_demand_on_server(demand_df, sql_file_path, db_server, db_name, bucket='daily', calendar=None,
+                             start=None, end=None):
+    """
+    Server-side variant of analyze_demand_with_bom.
+
+    The bucketed demand is bulk-loaded into a [#demand] temp table and joined
+    with the BOM query on the server (see component_demand_sql); only the
+    parent quantity per BOM line and bucket comes back. The demand cube is
+    built from those rows, so the reports match the client-side analysis.
+    """
+    try:
+        if 'Item Number' not in demand_df.columns:
             logger.error("Column 'Item Number' not found in demand data")
             return None
-            
+        
+        with open(sql_file_path, 'r') as file:
+            sql_query = component_demand_sql(file.read())
+        
+        buckets = demand_buckets(demand_df, bucket, calendar, start, end)
+        logger.info(f"Aggregating component demand on the server: {len(buckets)} demand rows "
+                    f"({bucket} buckets) bulk-loaded")
+        line_buckets = get_connection_pool(db_server, db_name).read_sql(
+            sql_query, prepare=lambda connection: load_demand_buckets(connection, buckets))
+        logger.info(f"Server-side aggregation returned {len(line_buckets)} BOM line demand rows")
+        
+        line_buckets = apply_schema(line_buckets, [], 'BOM line demand')
+        # Vendor and buyer columns are compared with each other, so they share their KEY_DOMAINS dtype
+        _, line_buckets = encode_keys(pd.DataFrame(), line_buckets)
+        demand_cube = DemandCube.from_line_buckets(line_buckets)
+        logger.info(f"Demand cube: {demand_cube.n_lines} BOM lines x {demand_cube.n_dates} dates")
+        return summarize_demand_cube(demand_cube)
     except Exception as e:
-        logger.error(f"Error analyzing demand with BOM: {str(e)}")
+        logger.error(f"Error aggregating component demand on the server: {str(e)}")
         logger.error(f"Stack trace:", exc_info=True)
         return None
 
-def save_results(results, output_path):
+def sheet_chunks(sheet_name, frame, rows_per_line, max_rows, chunk_lines):
+    """
+    Split lines greedily over sheet_name, "sheet_name 2", ... so that every sheet
+    holds at most max_rows - 1 data rows, where line i takes rows_per_line[i] rows.
+    Returns [(sheet name, chunks)], where chunks lazily yields the decoded
+    frame(start, stop) of at most chunk_lines lines at a time.
+    """
+    n_lines = len(rows_per_line)
+    rows_before = np.concatenate([[0], np.cumsum(rows_per_line)])
+    bounds = []
+    start = 0
+    while True:
+        stop = int(np.searchsorted(rows_before, rows_before[start] + max_rows - 1, side='right')) - 1
+        stop = min(max(stop, start + 1), n_lines)
+        bounds.append((start, stop))
+        if stop >= n_lines:
+            break
+        start = stop
+
+    def chunks(start, stop):
+        for chunk_start in range(start, max(stop, start + 1), chunk_lines):
+            yield decode_keys(frame(chunk_start, min(chunk_start + chunk_lines, stop)))
+
+    return [(sheet_name if number == 1 else f'{sheet_name} {number}', chunks(start, stop))
+            for number, (start, stop) in enumerate(bounds, start=1)]
+
+def component_demand_sheets(component_demand, max_rows=EXCEL_MAX_ROWS, max_columns=EXCEL_MAX_COLUMNS,
+                            chunk_rows=10000):
+    """
+    Lay the Component Demand view out within Excel's sheet limits, like
+    DemandCube.timeline_sheets: one column per date while they fit in
+    max_columns, otherwise one row per component and date with non-zero
+    demand; components are split over as many sheets as max_rows requires
+    """
+    key_columns = [col for col in component_demand.columns
+                   if col in COMPONENT_COLUMNS.values() or col == 'Total_Demand']
+    date_columns = [col for col in component_demand.columns if col not in key_columns]
+    wide = len(component_demand.columns) <= max_columns
+    logger.info(f"Component Demand layout: {'wide' if wide else 'long'}")
+
+    def long_frame(start, stop):
+        components = component_demand.iloc[start:stop]
+        demand = components[date_columns].to_numpy()
+        row_idx, date_idx = np.nonzero(demand)
+        long_df = components[key_columns].iloc[row_idx].reset_index(drop=True)
+        long_df['Date'] = pd.to_datetime(np.asarray(date_columns)[date_idx])
+        long_df['Demand'] = demand[row_idx, date_idx]
+        return long_df
+
+    if wide:
+        frame = lambda start, stop: component_demand.iloc[start:stop]
+        rows_per_line = np.ones(len(component_demand), dtype='int64')
+    else:
+        frame = long_frame
+        rows_per_line = np.count_nonzero(component_demand[date_columns].to_numpy(), axis=1)
+    return sheet_chunks('Component Demand', frame, rows_per_line, max_rows, chunk_rows)
+
+def report_sheets(results):
+    """
+    Sheets of the report workbook in order, as (sheet name, frame chunks) pairs;
+    the component demand and the timeline may span several sheets (see
+    component_demand_sheets and DemandCube.timeline_sheets)
+    """
+    inconsistent_data = results.get('inconsistent_data')
+    if inconsistent_data is None or inconsistent_data.empty:
+        inconsistent_data = pd.DataFrame({'Message': ['No inconsistencies found']})
+    demand_cube = results.get('demand_cube')
+    return (
+        component_demand_sheets(results['component_demand'])
+        + (demand_cube.timeline_sheets() if demand_cube is not None else [])
+        + [
+            ('Vendor Summary', [results['vendor_summary']]),
+            ('Product Line Summary', [results['product_line_summary']]),
+            ('Design Group Summary', [results['design_group_summary']]),
+            ('Combined Summary', [results['combined_summary']]),
+            ('Inconsistency Report', [inconsistent_data])
+        ]
+    )
+
+def write_sheet_streaming(workbook, sheet_name, frames, date_format, chunk_size=10000):
+    """
+    Stream frames with the same columns into one constant-memory XlsxWriter sheet.
+
+    Rows are written in chunks of plain Python values, and the widest
+    value of every column is tracked on the way, so column widths need no
+    second pass over the data.
+    """
+    worksheet = workbook.add_worksheet(sheet_name)
+    widths = None
+    row_idx = 1
+    for df in frames:
+        if widths is None:
+            widths = [len(str(col)) for col in df.columns]
+            worksheet.write_row(0, 0, [str(col) for col in df.columns])
+        for start in range(0, len(df), chunk_size):
+            row_idx = write_rows_streaming(worksheet, df.iloc[start:start + chunk_size], row_idx, widths, date_format)
+
+    # XlsxWriter writes column settings when the sheet is closed, so they may follow the rows
+    for col_idx, width in enumerate(widths or []):
+        worksheet.set_column(col_idx, col_idx, width + 2)
+
+def write_rows_streaming(worksheet, chunk, row_idx, widths, date_format):
+    """
+    Write one chunk of rows from row_idx on, widening widths in place; returns the next row index
+    """
+    columns = [chunk[col].tolist() for col in chunk.columns]
+    for row in zip(*columns):
+        for col_idx, value in enumerate(row):
+            if value is None or value is pd.NaT or (isinstance(value, float) and value != value):
+                continue
+            if isinstance(value, datetime):
+                worksheet.write_datetime(row_idx, col_idx, value, date_format)
+                length = 10
+            else:
+                worksheet.write(row_idx, col_idx, value)
+                length = len(str(value))
+            if length > widths[col_idx]:
+                widths[col_idx] = length
+        row_idx += 1
+    return row_idx
+
+def write_report_streaming(results, output_path):
+    """
+    Write the report workbook row by row with constant memory
+    """
+    workbook = xlsxwriter.Workbook(output_path, {'constant_memory': True})
+    try:
+        date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+        for sheet_name, frames in report_sheets(results):
+            write_sheet_streaming(workbook, sheet_name, frames, date_format)
+    finally:
+        workbook.close()
+
+def save_results(results, output_path, writer='openpyxl'):
     """
-    Save analysis results to Excel file
+    Save analysis results to Excel file, with the openpyxl workbook or the
+    constant-memory streaming writer (writer='streaming')
     """
     try:
         logger.info(f"Saving results to: {output_path}")
         
+        # Decode the categorical keys back to their text values
+        results = {name: decode_keys(value) if isinstance(value, pd.DataFrame) else value
+                   for name, value in results.items()}
+        
         # Create output directory if it doesn't exist
         output_dir = os.path.dirname(output_path)
-        if not os.path.exists(output_dir):
+        if output_dir and not os.path.exists(output_dir):
             os.makedirs(output_dir)
             logger.info(f"Created output directory: {output_dir}")
         
+        # Stream the rows when XlsxWriter is available
+        if writer == 'streaming':
+            if XLSXWRITER_AVAILABLE:
+                write_report_streaming(results, output_path)
+                if 'inconsistent_data' in results and not results['inconsistent_data'].empty:
+                    logger.info(f"Found {len(results['inconsistent_data'])} rows with inconsistencies")
+                else:
+                    logger.info("No inconsistencies found")
+                logger.info("Results saved successfully")
+                return True
+            logger.warning("XlsxWriter is not installed, using the openpyxl writer")
+        
         # Create a writer object
         with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-            # Write the component demand summary to the Excel file
-            component_demand = results['component_demand']
-            component_demand.to_excel(writer, sheet_name='Component Demand', index=False)
+            # Write the component demand summary chunk by chunk, laid out within the sheet limits
+            component_demand = None
+            for sheet_name, frames in component_demand_sheets(results['component_demand']):
+                startrow = 0
+                for component_chunk in frames:
+                    # Column widths are sized on the first chunk
+                    if component_demand is None:
+                        component_demand = component_chunk
+                    component_chunk.to_excel(writer, sheet_name=sheet_name, index=False,
+                                             startrow=startrow, header=startrow == 0)
+                    startrow += len(component_chunk) + (1 if startrow == 0 else 0)
             
-            # Write the pivot table to the Excel file
-            pivot_df = results['pivot_table']
-            pivot_df.to_excel(writer, sheet_name='Demand Timeline', index=False)
+            # Write the demand timeline chunk by chunk, laid out within the sheet limits
+            demand_cube = results.get('demand_cube')
+            for sheet_name, frames in demand_cube.timeline_sheets() if demand_cube is not None else []:
+                startrow = 0
+                for timeline_chunk in frames:
+                    timeline_chunk.to_excel(writer, sheet_name=sheet_name, index=False,
+                                            startrow=startrow, header=startrow == 0)
+                    startrow += len(timeline_chunk) + (1 if startrow == 0 else 0)
             
             # Write the summary dashboards
             results['vendor_summary'].to_excel(writer, sheet_name='Vendor Summary', index=False)
@@ -406,6 +2297,270 @@ def save_results(results, output_path):
         logger.error(f"Stack trace:", exc_info=True)
         return False
 
+def save_results_parquet(results, output_dir, compression='zstd'):
+    """
+    Save every result frame as a compressed Parquet file plus a manifest.json
+    listing the files, row counts and column types. Categorical keys are kept
+    as dictionary-encoded columns, so readers get the analysis dtypes back.
+    """
+    try:
+        if not PYARROW_AVAILABLE:
+            logger.error("Parquet output needs pyarrow, which is not installed")
+            return False
+        
+        logger.info(f"Saving Parquet results to: {output_dir}")
+        os.makedirs(output_dir, exist_ok=True)
+        
+        frames = {name: value for name, value in results.items() if isinstance(value, pd.DataFrame)}
+        if results.get('demand_cube') is not None:
+            frames['demand_timeline'] = results['demand_cube'].timeline_frame()
+        
+        manifest = {'created': datetime.now().isoformat(timespec='seconds'), 'files': {}}
+        for name, df in frames.items():
+            file_name = f"{name}.parquet"
+            df.to_parquet(os.path.join(output_dir, file_name), index=False, compression=compression)
+            manifest['files'][name] = {
+                'file': file_name,
+                'rows': len(df),
+                'columns': {str(col): str(dtype) for col, dtype in df.dtypes.items()}
+            }
+        
+        with open(os.path.join(output_dir, 'manifest.json'), 'w') as file:
+            json.dump(manifest, file, indent=2)
+        
+        logger.info(f"Parquet results saved: {len(frames)} files")
+        return True
+    except Exception as e:
+        logger.error(f"Error saving Parquet results: {str(e)}")
+        logger.error(f"Stack trace:", exc_info=True)
+        return False
+
+def append_run_history(results, db_path, source):
+    """
+    Append the run's component demand, summaries and inconsistencies to the
+    SQLite run-history database, keyed by a run_id row in the runs table
+    (run timestamp and source exports). Demand per date is stored long and
+    sparse, one row per component and date with non-zero demand.
+    """
+    try:
+        logger.info(f"Appending run to history database: {db_path}")
+        key_columns = list(COMPONENT_COLUMNS.values())
+        component_demand = decode_keys(results['component_demand'])
+        date_columns = [col for col in component_demand.columns if col not in key_columns + ['Total_Demand']]
+        
+        demand_by_date = component_demand.melt(id_vars=key_columns, value_vars=date_columns,
+                                               var_name='Date', value_name='Demand')
+        demand_by_date = demand_by_date[demand_by_date['Demand'] != 0]
+        
+        inconsistent_data = decode_keys(results['inconsistent_data'])
+        inconsistency_columns = [col for col in key_columns + ['Total_Demand', 'Vendor_Mismatch', 'Buyer_Mismatch']
+                                 if col in inconsistent_data.columns]
+        
+        tables = {
+            'component_demand': component_demand[key_columns + ['Total_Demand']],
+            'component_demand_by_date': demand_by_date,
+            'vendor_summary': decode_keys(results['vendor_summary']),
+            'product_line_summary': decode_keys(results['product_line_summary']),
+            'design_group_summary': decode_keys(results['design_group_summary']),
+            'combined_summary': decode_keys(results['combined_summary']),
+            'inconsistencies': inconsistent_data[inconsistency_columns]
+        }
+        indexes = {
+            'component_demand': ['Component', 'Plant'],
+            'component_demand_by_date': ['Component', 'Date'],
+            'vendor_summary': ['Vendor'],
+            'inconsistencies': ['Component']
+        }
+        
+        conn = sqlite3.connect(db_path)
+        try:
+            with conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS runs ("
+                             "run_id INTEGER PRIMARY KEY AUTOINCREMENT, run_timestamp TEXT NOT NULL, source TEXT)")
+                run_id = conn.execute("INSERT INTO runs (run_timestamp, source) VALUES (?, ?)",
+                                      (datetime.now().isoformat(timespec='seconds'), source)).lastrowid
+                for name, df in tables.items():
+                    df = df.copy()
+                    df.insert(0, 'run_id', run_id)
+                    df.to_sql(name, conn, if_exists='append', index=False)
+                    conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{name}_run" ON "{name}" (run_id)')
+                    if name in indexes:
+                        columns = ', '.join(f'"{col}"' for col in indexes[name])
+                        conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{name}_key" ON "{name}" ({columns}, run_id)')
+        finally:
+            conn.close()
+        
+        logger.info(f"Run {run_id} appended to history database")
+        return True
+    except Exception as e:
+        logger.error(f"Error appending run history: {str(e)}")
+        logger.error(f"Stack trace:", exc_info=True)
+        return False
+
+def write_partition(demand_cube, output_path, writer):
+    """
+    Summarize and save one partition of the demand cube (runs in a worker process)
+    """
+    results = summarize_demand_cube(demand_cube)
+    saved = save_results(results, output_path, writer)
+    return saved, len(results['component_demand']), results['component_demand']['Total_Demand'].sum()
+
+def save_partitioned_results(results, output_path, partition_by, writer='openpyxl', max_workers=None):
+    """
+    Save one workbook per value of partition_by (Plant, Vendor or Product_Line).
+
+    The demand cube is split by line, and each partition is summarized and
+    written in its own worker process. output_path gets an index workbook
+    listing the partition files.
+    """
+    try:
+        demand_cube = results['demand_cube']
+        values = demand_cube.lines[PARTITION_COLUMNS[partition_by]]
+        base, extension = os.path.splitext(output_path)
+        
+        partitions = []
+        for value in pd.unique(values.dropna()):
+            file_name = re.sub(r'[^\w.-]+', '_', str(value))
+            partitions.append((value, f"{base}_{partition_by}_{file_name}{extension}"))
+        logger.info(f"Writing {len(partitions)} partitions by {partition_by}...")
+        
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(write_partition, demand_cube.subset((values == value).to_numpy()), path, writer)
+                       for value, path in partitions]
+            outcomes = [future.result() for future in futures]
+        
+        index = pd.DataFrame([
+            (str(value), os.path.basename(path), components, total)
+            for (value, path), (saved, components, total) in zip(partitions, outcomes) if saved
+        ], columns=[partition_by, 'File', 'Components', 'Total_Demand'])
+        index = index.sort_values(partition_by)
+        failed = [path for (_, path), (saved, _, _) in zip(partitions, outcomes) if not saved]
+        for path in failed:
+            logger.error(f"Failed to save partition: {path}")
+        
+        output_dir = os.path.dirname(output_path)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        index.to_excel(output_path, sheet_name='Partitions', index=False)
+        logger.info(f"Partition index saved to: {output_path}")
+        return not failed
+    except Exception as e:
+        logger.error(f"Error saving partitioned results: {str(e)}")
+        logger.error(f"Stack trace:", exc_info=True)
+        return False
+
+def read_demand(excel_file, args):
+    """
+    Read the export directly or through the export cache, as selected on the command line
+    """
+    if args.no_cache:
+        return read_excel_data(excel_file)
+    return read_excel_data_cached(excel_file, args.cache_dir, args.cache_max_mb * 1024 * 1024)
+
+def read_bom(args, items=None):
+    """
+    Run the BOM query directly or through the query result cache, as selected
+    on the command line, optionally restricted to the parents in items
+    """
+    cache = None
+    if not args.no_cache and args.query_cache_hours > 0:
+        cache = QueryCache(os.path.join(args.cache_dir, 'sql'), args.query_cache_hours * 3600,
+                           args.cache_max_mb * 1024 * 1024, args.refresh_query)
+    return execute_sql_query(args.sql_file, args.db_server, args.db_name, args.sql_chunk_rows, args.per_plant, cache,
+                             items)
+
+def read_demand_batch(excel_files, args):
+    """
+    Parse several exports in a process pool and combine them into one demand
+    frame, with the export's file name in a Source column
+    """
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        frames = list(executor.map(read_demand, excel_files, [args] * len(excel_files)))
+    
+    combined = []
+    for excel_file, frame in zip(excel_files, frames):
+        if frame is None:
+            logger.error(f"Skipping export that could not be read: {excel_file}")
+            continue
+        frame['Source'] = os.path.splitext(os.path.basename(excel_file))[0]
+        combined.append(frame)
+    if not combined:
+        return None
+    
+    demand_df = pd.concat(combined, ignore_index=True)
+    logger.info(f"Combined {len(combined)} exports: {len(demand_df)} rows")
+    return demand_df
+
+def run_analysis(excel_files, args):
+    """
+    Run the analysis for one or more exports and save the report
+    """
+    # Step 2: Read customer demand data from Excel
+    if len(excel_files) == 1:
+        demand_df = read_demand(excel_files[0], args)
+    else:
+        demand_df = read_demand_batch(excel_files, args)
+    if demand_df is None:
+        logger.error("Failed to read demand data.")
+        return False
+    
+    if args.server_aggregate:
+        # Steps 3-5 on the database server: only the component demand comes back
+        results = analyze_demand_on_server(demand_df, args.sql_file, args.db_server, args.db_name,
+                                           args.bucket, args.calendar, args.horizon_start, args.horizon_end)
+    else:
+        # Step 3: Execute SQL query to get BOM data
+        items = None
+        if args.push_items:
+            if args.explode_bom:
+                # Sub-assemblies below the demand items are BOM parents too
+                logger.warning("--push-items is ignored with --explode-bom, which needs every BOM level")
+            else:
+                items = demand_df['Item Number'].dropna().astype(str).str.strip().unique()
+        bom_df = read_bom(args, items)
+        if bom_df is None:
+            logger.error("Failed to get BOM data.")
+            return False
+        
+        # Encode the key columns once for the merge and groupbys
+        demand_df, bom_df = encode_keys(demand_df, bom_df)
+        
+        # Step 4: Load or refresh the BOM closure index for the explosion
+        bom_closure = None
+        if args.explode_bom and args.bom_index:
+            bom_closure = build_bom_closure(bom_df, args.bom_index)
+        
+        # Step 5: Analyze demand with BOM data
+        if args.incremental_state:
+            results = analyze_demand_incremental(demand_df, bom_df, args.incremental_state, args.verbose,
+                                                 args.explode_bom, bom_closure, args.bucket, args.calendar,
+                                                 args.horizon_start, args.horizon_end)
+        else:
+            results = analyze_demand_with_bom(demand_df, bom_df, args.verbose, args.explode_bom, bom_closure,
+                                              args.bucket, args.calendar, args.horizon_start, args.horizon_end)
+    if results is None:
+        logger.error("Failed to analyze demand with BOM.")
+        return False
+    
+    # Step 6: Save results, one workbook per partition if requested, and/or as Parquet
+    saved = True
+    if not args.no_excel:
+        if args.partition_by:
+            saved = save_partitioned_results(results, args.output, args.partition_by, args.writer, args.workers)
+        else:
+            saved = save_results(results, args.output, args.writer)
+    if args.parquet_dir:
+        saved = save_results_parquet(results, args.parquet_dir) and saved
+    if args.history_db:
+        source = ', '.join(os.path.basename(excel_file) for excel_file in excel_files)
+        saved = append_run_history(results, args.history_db, source) and saved
+    if saved:
+        destinations = ([] if args.no_excel else [args.output]) + ([args.parquet_dir] if args.parquet_dir else [])
+        logger.info(f"Analysis completed successfully. Results saved to {', '.join(destinations)}")
+        return True
+    logger.error("Failed to save results.")
+    return False
+
 def main():
     try:
         # Parse command line arguments
@@ -416,35 +2571,43 @@ def main():
             logging.getLogger().setLevel(logging.DEBUG)
             logger.debug("Verbose logging enabled")
         
-        # Step 1: Get the latest Excel file
-        excel_file = get_latest_excel_file(args.excel_dir)
-        if not excel_file:
-            logger.error("Could not find Excel file. Exiting.")
-            return
-        
-        # Step 2: Read customer demand data from Excel
-        demand_df = read_excel_data(excel_file)
-        if demand_df is None:
-            logger.error("Failed to read demand data. Exiting.")
+        # Where-used lookup instead of the full analysis
+        if args.command == 'where-used':
+            bom_df = read_bom(args)
+            if bom_df is None:
+                logger.error("Failed to get BOM data. Exiting.")
+                return
+            
+            # Demand shares come from the latest export when there is one
+            demand_df = None
+            excel_file = get_latest_excel_file(args.excel_dir)
+            if excel_file:
+                demand_df = read_demand(excel_file, args)
+            
+            usage = where_used(build_where_used(bom_df), args.component, args.plant, demand_df)
+            if usage.empty:
+                logger.warning(f"Component {args.component} is not used in any BOM")
+            else:
+                logger.info(f"\nWhere used: {args.component}\n{usage.to_string(index=False)}")
             return
         
-        # Step 3: Execute SQL query to get BOM data
-        bom_df = execute_sql_query(args.sql_file, args.db_server, args.db_name)
-        if bom_df is None:
-            logger.error("Failed to get BOM data. Exiting.")
+        # Watch mode: analyze every export as soon as it is fully written
+        if args.watch:
+            watch_exports(args.excel_dir, args.watch_pattern, lambda excel_file: run_analysis([excel_file], args))
             return
         
-        # Step 4: Analyze demand with BOM data
-        results = analyze_demand_with_bom(demand_df, bom_df, args.verbose)
-        if results is None:
-            logger.error("Failed to analyze demand with BOM. Exiting.")
+        # Step 1: Get the exports to analyze, by default the latest Excel file
+        if args.exports:
+            excel_files = find_exports(args.exports)
+        else:
+            excel_file = get_latest_excel_file(args.excel_dir)
+            excel_files = [excel_file] if excel_file else []
+        if not excel_files:
+            logger.error("Could not find Excel file. Exiting.")
             return
         
-        # Step 5: Save results
-        if save_results(results, args.output):
-            logger.info(f"Analysis completed successfully. Results saved to {args.output}")
-        else:
-            logger.error("Failed to save results.")
+        if not run_analysis(excel_files, args):
+            logger.error("Analysis failed. Exiting.")
     
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}")
@@ -155,8 +155,8 @@ def find_qad_windows():
     logger.info(f"Found {len(filtered_windows)} QAD windows")
     return filtered_windows
 
-def handle_qad_export(driver, logger):
-    """Handle the QAD export process"""
+def handle_qad_export(driver, logger, export_format='xlsx'):
+    """Handle the QAD export process (export_format: 'xlsx' workbook or 'csv' UTF-8 text)"""
     try:
         # Wait for QAD menu to load
         logger.info("Waiting for QAD menu to load...")
@@ -213,10 +213,22 @@ def handle_qad_export(driver, logger):
         pyautogui.press('3')
         time.sleep(1)
         
-        # Type EDI_Demand and save
+        # Type EDI_Demand
         logger.info("Saving file as EDI_Demand...")
         pyautogui.write('EDI_Demand')
         time.sleep(1)
+        
+        # Alt+T > CSV UTF-8 to switch the Save as type for text export
+        if export_format == 'csv':
+            logger.info("Selecting CSV UTF-8 format...")
+            pyautogui.hotkey('alt', 't')
+            time.sleep(1)
+            pyautogui.write('CSV UTF-8')
+            time.sleep(1)
+            pyautogui.press('enter')
+            time.sleep(1)
+        
+        # Save
         pyautogui.press('enter')
         time.sleep(1)
         
@@ -236,7 +248,13 @@ def handle_qad_export(driver, logger):
         pyautogui.press('c')
         time.sleep(1)
         
-        excel_file_path = os.path.join(os.environ['TEMP'], 'Shell', 'EDI_Demand.xlsx')
+        # A text export is a single sheet; Excel asks to save the workbook again on close
+        if export_format == 'csv':
+            logger.info("Declining to save the CSV again...")
+            pyautogui.press('n')
+            time.sleep(1)
+        
+        excel_file_path = os.path.join(os.environ['TEMP'], 'Shell', f'EDI_Demand.{export_format}')
         logger.info(f"Excel file saved to: {excel_file_path}")
         return excel_file_path
         
@@ -252,6 +270,8 @@ def main():
     parser.add_argument('--password', required=True, help='QAD password')
     parser.add_argument('--state-id', help='QAD state ID for custom folder navigation')
     parser.add_argument('--force', action='store_true', help='Force execution even if QAD processes are running')
+    parser.add_argument('--export-format', choices=['xlsx', 'csv'], default='xlsx',
+                        help='Format of the QAD export: Excel workbook or CSV text (faster to save and parse)')
     args = parser.parse_args()
     
     # Set up logging
@@ -319,7 +339,7 @@ def main():
             time.sleep(30)
             
             # Handle QAD export process
-            excel_file_path = handle_qad_export(driver, logger)
+            excel_file_path = handle_qad_export(driver, logger, args.export_format)
             if not excel_file_path:
                 logger.error("Failed to export data from QAD")
                 return 1
@@ -327,11 +347,11 @@ def main():
             # Step 2: Run Analyze Demand to process the exported data
             logger.info("Step 2: Running Analyze Demand to process the exported data")
             
-            # Build the command for analyze_demand.py
+            # Build the command for analyze_demand.py; it reads both the Excel and the CSV export
             analyze_cmd = [
-                sys.executable, 
-                "Earlier Scripts/analyze_demand.py",
-                "--excel-file", excel_file_path
+                sys.executable,
+                "analyze_demand.py",
+                "--exports", excel_file_path
             ]
             
             # Run the Analyze Demand script
@@ -11,6 +11,7 @@ WITH
       [QADEE].[dbo].[ps_mstr]
     WHERE 
       [ps_end] IS NULL
+      -- @demand_items: AND [ps_par] IN (SELECT [item] FROM [#demand_items])
     UNION ALL
     SELECT 
       '2798' AS [Plant],
@@ -22,6 +23,7 @@ WITH
       [QADEE2798].[dbo].[ps_mstr]
     WHERE 
       [ps_end] IS NULL
+      -- @demand_items: AND [ps_par] IN (SELECT [item] FROM [#demand_items])
   ),
 
   -- Second Table: Data from PodData + pt_mstr (25 columns)
@@ -0,0 +1,16 @@
+-- Per-plant form of BOMs.sql: analyze_demand.py --per-plant fills in the plant
+-- and its database and runs one statement per plant concurrently
+SELECT 
+    '{plant}' AS [Plant],
+    [ps_par],  
+    [ps_comp],  
+    [ps_ref],  
+    [ps_qty_per],  
+    [ps_rmks]
+  
+FROM 
+    [{database}].[dbo].[ps_mstr]
+WHERE 
+    [ps_end] is null  -- Apply the filter condition
+    -- @demand_items: AND [ps_par] IN (SELECT [item] FROM [#demand_items])
+;
\ No newline at end of file
@@ -10,6 +10,7 @@ FROM
     [QADEE].[dbo].[ps_mstr]
 WHERE 
     [ps_end] is null  -- Apply the filter condition
+    -- @demand_items: AND [ps_par] IN (SELECT [item] FROM [#demand_items])
 
 UNION ALL
 
@@ -24,4 +25,6 @@ SELECT
 FROM 
     [QADEE2798].[dbo].[ps_mstr]
 WHERE 
-    [ps_end] is null;  -- Apply the filter condition
\ No newline at end of file
+    [ps_end] is null  -- Apply the filter condition
+    -- @demand_items: AND [ps_par] IN (SELECT [item] FROM [#demand_items])
+;
\ No newline at end of file